@@ -0,0 +1,200 @@
+#####
+# asyncio interface of dpath and fpath (python >= 3.5)
+#
+# The blocking calls of the paths are run in a thread executor shared by all
+# the paths. Before running, a call waits in the event loop for a lease on the
+# connection of its path: one call at a time on a single ftp connection, at most
+# maxsize calls on a FtpPool. So thousands of concurrent operations can wait in
+# one event loop without holding executor threads, and the commands sent on a
+# ftp control channel never interleave.
+#
+# This module is imported by the first call to an asynchronous method
+# (dpath.als, fpath.aopen, ...).
+######
+from concurrent.futures import ThreadPoolExecutor
+from ftplib import FTP
+import functools
+import threading
+import asyncio
+import weakref
+
+## number of threads of the default executor
+ASYNC_WORKERS = 32
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """ the executor running the blocking calls, created on first use """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(ASYNC_WORKERS)
+    return _executor
+
+def set_executor(executor):
+    """ use an other concurrent.futures executor for the blocking calls """
+    global _executor
+    with _executor_lock:
+        _executor = executor
+
+
+## connection -> (loop, semaphore)
+_leases = weakref.WeakKeyDictionary()
+
+def _semaphore(c):
+    """ the semaphore limiting the concurrent calls on connection c, or None """
+    if hasattr(c, "lease"): # a FtpPool
+        size = c.maxsize
+    elif isinstance(c, FTP):
+        size = 1
+    else:
+        return None
+    loop = asyncio.get_event_loop()
+    try:
+        l, sem = _leases[c]
+    except KeyError:
+        l = None
+    if l is not loop:
+        sem = asyncio.Semaphore(size)
+        _leases[c] = (loop, sem)
+    return sem
+
+
+class lease(object):
+    """ asynchronous context manager holding a lease on a connection
+
+        >>> async with lease(d.c):
+        ...     await run_blocking(...)
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self._sem = None
+
+    async def __aenter__(self):
+        self._sem = _semaphore(self.connection)
+        if self._sem is not None:
+            await self._sem.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._sem is not None:
+            self._sem.release()
+            self._sem = None
+
+
+def _run(func, *args, **kwargs):
+    """ run func in the executor and return the future """
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+def _connection(path):
+    ## the handler is created here, it can block (e.g. http)
+    return path.c
+
+async def arun(path, func, *args, **kwargs):
+    """ call func(*args, **kwargs) in the executor, with a lease on the connection of path
+
+        >>> await arun(d, d.makedirs, "a/b")
+    """
+    c = await _run(_connection, path)
+    async with lease(c):
+        return await _run(func, *args, **kwargs)
+
+
+_END = object()
+
+class AsyncWalk(object):
+    """ asynchronous iterator of dpath.iterwalk, one directory per step
+
+        >>> async for d, dirs, files in AsyncWalk(dpath("ftp://server.com/data")):
+        ...     print(d, len(files))
+    """
+    def __init__(self, top, topdown=True, followlinks=False):
+        self.top = top
+        self._it = top.iterwalk(topdown, followlinks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await arun(self.top, next, self._it, _END)
+        if item is _END:
+            raise StopAsyncIteration
+        return item
+
+
+class AsyncFile(object):
+    """ asynchronous file open from a fpath
+
+    The connection of the path is leased from the open to the close of the
+    file. It can be used as an async context manager or awaited:
+
+        >>> async with f.aopen("rb") as fh:
+        ...     data = await fh.read()
+        >>> fh = await f.aopen()
+        >>> async for line in fh:
+        ...     print(line)
+        >>> await fh.close()
+    """
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.mode = mode
+        self.file = None
+        self._lease = None
+
+    def __repr__(self):
+        return "<async %r>"%(self.file if self.file is not None else self.path)
+
+    async def open(self):
+        c = await _run(_connection, self.path)
+        self._lease = lease(c)
+        await self._lease.__aenter__()
+        try:
+            self.file = await _run(self.path.open, self.mode)
+        except BaseException:
+            await self._lease.__aexit__()
+            raise
+        return self
+
+    def __await__(self):
+        return self.open().__await__()
+
+    async def __aenter__(self):
+        if self.file is None:
+            await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self.file is None:
+            return
+        try:
+            await _run(self.file.close)
+        finally:
+            self.file = None
+            await self._lease.__aexit__()
+
+    async def read(self, size=-1):
+        return await _run(self.file.read, size)
+
+    async def readline(self):
+        return await _run(self.file.readline)
+
+    async def readlines(self):
+        return await _run(self.file.readlines)
+
+    async def write(self, data):
+        return await _run(self.file.write, data)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        line = await self.readline()
+        if not line:
+            raise StopAsyncIteration
+        return line
@@ -1,15 +1,22 @@
 from __future__ import print_function
-from .shared import log, scheme_lookup, connection
+from .shared import log, scheme_lookup, connection, entry, link_entry, walk_scan, iterglob, compile_glob
 from .__local__ import LocalDirectory
-from ftplib import FTP, error_perm, error_temp, all_errors
+from .__ftpstat__ import ftp_scan, ftp_iterscan, ftp_time, ftp_cache
+from .__ftppool__ import FtpPool, ftp_pool, ftp_lease, ftp_lock
+from ftplib import error_perm, error_temp, all_errors
 try:
     from urlparse import urlsplit, urlparse #python 2.7
 except:
     from urllib.parse import urlsplit, urlparse
 
-import time
 import glob
 import os
+import io
+import threading
+try:
+    from Queue import Queue, Empty # python 2.7
+except ImportError:
+    from queue import Queue, Empty
 try:
     from StringIO import StringIO # python 2.7
     _P3 = False
@@ -21,11 +28,25 @@ except:
 
 VERBOSE = True
 FORCE = True
+## if True, files open in 'r' or 'rb' mode are streamed from the data connection
+## instead of being downloaded in memory when open 
+STREAM_READ = True
+## if True, files open in 'w' or 'a' mode are sent while written instead of 
+## being kept in memory and sent when closed
+STREAM_WRITE = True
+## buffer size of the streamed files 
+BLOCKSIZE = 64*1024
+## name of the journal of completed files written in the local directory
+## of a resumable batch transfer 
+JOURNAL = ".ftpjournal"
+
+## returned when a path cannot be found from a listing of its parent
+UNKNOWN = entry("", "unknown")
 
 
 class FtpDirectory(LocalDirectory):
     """ Directory handler with FTP connection """
-    ftp = None
+    __slots__ = ("remotedirectory", "ftp")
 
     def __init__(self,  url, ftp=None):
         """ a path to a ftp directory """
@@ -34,14 +55,9 @@ class FtpDirectory(LocalDirectory):
             if url.scheme not in ["ftp","sftp"]:
                 raise ValueError("scheme must be 'ftp://' for a FtpDirectory")
             if ftp is None:
-                ftp = FTP(url.hostname, url.username, url.password)
-                #ftp = FTP(url.hostname)
-                ftp.connect(url.hostname, url.port or 0)
-                if url.username:
-                    ftp.login(url.username, url.password)
-
-                ## store the username in the ftp so it can recovered later
-                ftp.username = url.username
+                ## connections are shared by all the directories of the same 
+                ## (host, port, user) and are logged in background
+                ftp = ftp_pool(url.hostname, url.port, url.username, url.password)
                 username = url.username
                 hostname = url.hostname              
             else:
@@ -83,68 +99,195 @@ class FtpDirectory(LocalDirectory):
 
     @property
     def connection(self):
-        return connection('ftp', self._get_ftp())
+        return connection('ftp', self.ftp)
 
     def _get_ftp(self):
-        return self.ftp
+        """ lease a ftp connection for one operation 
+
+            >>> with self._get_ftp() as ftp:
+            ...     ftp.nlst()
+        """
+        return ftp_lease(self.ftp)
 
     def login(self, user, password):
-        return self._get_ftp().login(user, password)
+        if isinstance(self.ftp, FtpPool):
+            return self.ftp.login(user, password)
+        with self._get_ftp() as ftp:
+            return ftp.login(user, password)
 
     def put(self, files):
         """ put files in the directory 
 
         files can be a string glob as e.g. "*.txt" or a list of file path
         """
-        ftp = self._get_ftp()
+        with self._get_ftp() as ftp:
 
-        if isinstance(files, basestring):
-            files = ls(files)            
+            if isinstance(files, basestring):
+                files = ls(files)            
 
-        for file in files:
-            with open(file,'rb') as f:
-                d, filename = os.path.split(file)              
-                ftp.storbinary('STOR %s'%os.path.join(self.remotedirectory,filename), f)     # send the file
-                log.notice("file '%s' transfered in '%s' "%(file, self.directory))
+            for file in files:
+                with open(file,'rb') as f:
+                    d, filename = os.path.split(file)              
+                    ftp.storbinary('STOR %s'%os.path.join(self.remotedirectory,filename), f)     # send the file
+                    ftp_cache(self.ftp).invalidate(os.path.join(self.remotedirectory,filename))
+                    log.notice("file '%s' transfered in '%s' "%(file, self.directory))
     
 
     def rmtree(self, path):
         """ remove the subrirectory in path """
-        ftp = self._get_ftp()        
-        return ftp_rmtree(ftp, os.path.join(self.remotedirectory, path))
+        path = os.path.join(self.remotedirectory, path)
+        try:
+            with self._get_ftp() as ftp:
+                return ftp_rmtree(ftp, path)
+        finally:
+            ftp_cache(self.ftp).invalidate(path)
 
     def ls(self, glob='*'):
-        """ list file in directory from glob. e.g. '*.txt' 
+        """ list file in directory from glob. e.g. '*.txt', '**/*.fits' 
 
         The returned path are relative 
         """
-        ftp = self._get_ftp() 
-        glob = ftp_path2path(ftp, glob)         
-        return remove_roots(ftp_ls(ftp, os.path.join(self.remotedirectory,glob)), self.remotedirectory)        
+        return [e.name for e in self.scan(glob)]
+
+    def scan(self, glb='*'):
+        """ list the directories in one command each and return a list of entry
+
+        entry are (name, type, size, mtime) tuples of the items matching the 
+        glob, e.g. '*.txt'. Only the directories which can match are listed.
+        """
+        glb = ftp_path2path(self.ftp, glb)
+        return list(iterglob(glb, self._listdir))
+
+    def scan_globs(self, globs, exclude=()):
+        """ list of entry matching each glob of the list globs, minus the exclude globs
+
+        All the globs are searched in one walk, each directory is listed in one
+        command.
+        """
+        globs = [ftp_path2path(self.ftp, g) for g in globs]
+        return LocalDirectory.scan_globs(self, globs, exclude)
+
+    ## the names are looked up in the listing of their directory
+    _lookup = None
+
+    def iterscan(self, glb='*'):
+        """ iterator of the entry matching glob, yielded while the listings arrive """
+        glb = ftp_path2path(self.ftp, glb)
+        return compile_glob(glb).iterglob(self._iterdir)
+
+    def _iterdir(self, top):
+        """ iterator of the entry of a sub-directory, streamed from the data connection
+
+        A fresh listing in the cache is used if any. Otherwise a connection 
+        is dedicated to the listing until it is over (on a single ftp 
+        connection, it should not be used meanwhile).
+        """
+        directory = os.path.join(self.remotedirectory, top)
+        entries = ftp_cache(self.ftp).get(directory)
+        if entries is not None:
+            for e in entries:
+                yield e
+            return
+        links = []
+        with ftp_lease(self.ftp, shared=False) as ftp:
+            try:
+                for e in ftp_iterscan(ftp, directory):
+                    if e.type in _UNTYPED:
+                        links.append(e)
+                    else:
+                        yield e
+            except error_perm: # e.g. the directory does not exists
+                return
+            ## the type of the links (and of the NLST names) is asked when the 
+            ## listing is over
+            for e in links:
+                yield _ftp_resolve(ftp, os.path.join(directory, e.name), e)
+
+    def _listdir(self, top):
+        """ list of entry of a sub-directory, [] if it cannot be listed """
+        try:
+            return self._listing(os.path.join(self.remotedirectory, top))
+        except error_perm: # e.g. the directory does not exists
+            return []
+
+    def iterwalk(self, topdown=True, followlinks=False):
+        """ iterative directory tree walk, one listing per directory 
+
+        yield (relative directory, directory names, file names) tuples. The 
+        links to a directory are entered only if followlinks is True.
+        """
+        return walk_scan(self._listdir, topdown, followlinks)
+
+    def _listing(self, directory):
+        """ list of entry of a remote directory, taken from the cache if fresh enough """
+        cache = ftp_cache(self.ftp)
+        entries = cache.get(directory)
+        if entries is None:
+            with self._get_ftp() as ftp:
+                entries = [_ftp_resolve(ftp, os.path.join(directory, e.name), e) if e.type in _UNTYPED else e
+                           for e in ftp_scan(ftp, directory)]
+            cache.set(directory, entries)
+        return entries
+
+    def _entry(self, path):
+        """ entry of a relative path found in one listing of its parent 
+
+        Return None if the path is not in the parent listing and UNKNOWN if the
+        parent cannot be listed (e.g. the top directory of the connection).
+        """
+        path = os.path.normpath(os.path.join(self.remotedirectory, ftp_path2path(self.ftp, path)))
+        parent, name = os.path.split(path)
+        if name in ("", ".", ".."):
+            return UNKNOWN
+        try:
+            entries = self._listing(parent)
+        except error_perm:
+            return UNKNOWN
+        for e in entries:
+            if e.name == name:
+                return e
+        return None
 
     def listdir(self):
-        ftp = self._get_ftp()
-        return ftp.nlst()
+        with self._get_ftp() as ftp:
+            return ftp.nlst()
         
-    def get(self, files, inside, child=None):
-        """ 
+    def get(self, files, inside, child=None, workers=1, errors=None, resume=False):
+        """ download files inside a local directory and return the list of local path
+
         Parameters
         ----------
         files : string
             file glob 
+        inside : string
+            local directory 
+        child : callable, optional
+            wrapper around the returned local path 
+        workers : int, optional
+            number of files downloaded in parallel, each on its own connection 
+            leased from the pool
+        errors : list, optional
+            if given, the (remote, exception) of the failed files are appended 
+            and the other files are still downloaded 
+        resume : bool, optional
+            continue the partial local files and skip the files completed by
+            a previous interrupted call
         """
-        child = child or self.fpath
-
-        ftp = self._get_ftp()
-        file = ftp_path2path(ftp, file)        
-        return [child(f) for f in ftp_mget(ftp, os.path.join(self.remotedirectory, files), inside)]
+        child = child or (lambda x:x)
+        files = ftp_path2path(self.ftp, files)
+        remotes = [os.path.join(self.remotedirectory, e.name) for e in self.scan(files) if not e.isdir]
+        return [child(f) for f in ftp_mget(self.ftp, remotes, inside or "", workers=workers, errors=errors, resume=resume)]
 
     if _P3:
         def open(self, file, mode='r'):    
             """ open a file inside directory """ 
-            ftp =  self._get_ftp()
+            ftp =  self.ftp
             file = ftp_path2path(ftp, file)
             #print ("FTP %s"% os.path.join(self.remotedirectory, file))
+            if STREAM_READ and mode in ('r', 'rb'):
+                return ftp_open_reader(ftp, os.path.join(self.remotedirectory, file), mode)
+            if STREAM_WRITE and mode in ('w', 'wb', 'a', 'ab'):
+                return ftp_open_writer(ftp, os.path.join(self.remotedirectory, file), mode)
             if 'b' in mode:
                 return FtpBytesFile(ftp, os.path.join(self.remotedirectory, file), mode)  
             else:
@@ -153,18 +296,63 @@ class FtpDirectory(LocalDirectory):
     else:
         def open(self, file, mode='r'):    
             """ open a file inside directory """ 
-            ftp =  self._get_ftp()
+            ftp =  self.ftp
             file = ftp_path2path(ftp, file)
             #print ("FTP %s"% os.path.join(self.remotedirectory, file))
+            if STREAM_READ and mode in ('r', 'rb'):
+                return ftp_open_reader(ftp, os.path.join(self.remotedirectory, file), mode)
+            if STREAM_WRITE and mode in ('w', 'wb', 'a', 'ab'):
+                return ftp_open_writer(ftp, os.path.join(self.remotedirectory, file), mode)
             return FtpFile(ftp, os.path.join(self.remotedirectory, file), mode)  
 
-    def getmtime(self,file=''):
-        ftp = self._get_ftp()
-        file = ftp_path2path(ftp, file)
+    def rename(self, file, other, newfile):
+        """ rename file to newfile of the directory handler other with RNFR/RNTO 
+
+        other must be on the same connection. Return False if the server does 
+        not support it.
+        """
+        src = os.path.join(self.remotedirectory, ftp_path2path(self.ftp, file))
+        dst = os.path.join(other.remotedirectory, ftp_path2path(other.ftp, newfile))
+        try:
+            with self._get_ftp() as ftp:
+                ftp.rename(src.rstrip("/") or ".", dst.rstrip("/") or ".")
+        except error_perm as e:
+            if str(e)[:3] in ("500", "502", "504"):
+                return False
+            raise
+        finally:
+            cache = ftp_cache(self.ftp)
+            cache.invalidate(src)
+            cache.invalidate(dst)
+        return True
+
+    def remove(self, file):
+        """ remove a file of the directory """
+        file = os.path.join(self.remotedirectory, ftp_path2path(self.ftp, file))
+        try:
+            with self._get_ftp() as ftp:
+                ftp.delete(file)
+        finally:
+            ftp_cache(self.ftp).invalidate(file)
 
-        t = ftp.sendcmd("MDTM %s"%(os.path.join(self.remotedirectory, file)))
-        t = time.strptime(t[4:], "%Y%m%d%H%M%S")
-        return time.mktime(t)
+    def readblocks(self, file, callback, blocksize=BLOCKSIZE):
+        """ read a remote file by blocks and call callback(block) for each 
+
+        The blocks are passed as they are received by retrbinary.
+        """
+        file = ftp_path2path(self.ftp, file)
+        with self._get_ftp() as ftp:
+            ftp.retrbinary("RETR %s"%os.path.join(self.remotedirectory, file), callback, blocksize)
+
+    def getmtime(self,file=''):
+        file = ftp_path2path(self.ftp, file)
+        if file:
+            e = self._entry(file)
+            if e and e.mtime is not None:
+                return e.mtime
+        with self._get_ftp() as ftp:
+            t = ftp.sendcmd("MDTM %s"%(os.path.join(self.remotedirectory, file)))
+            return ftp_time(t[4:])
 
     def stat(self, file=''):
         raise RuntimeError("Cannot get stat from ftp connection. Modification date only")  
@@ -176,44 +364,52 @@ class FtpDirectory(LocalDirectory):
         raise RuntimeError("Cannot get creation time from ftp connection. Modification date only")            
     
     def getsize(self, file=''):
-        ftp = self._get_ftp()
-        file = ftp_path2path(ftp, file)        
-        return ftp.size(os.path.join(self.remotedirectory, file))
-        #raise RuntimeError("Cannot get size from ftp connection. Modification date only")            
+        file = ftp_path2path(self.ftp, file)
+        if file:
+            e = self._entry(file)
+            if e and e.isfile and e.size is not None:
+                return e.size
+        with self._get_ftp() as ftp:
+            return ftp.size(os.path.join(self.remotedirectory, file))
+            #raise RuntimeError("Cannot get size from ftp connection. Modification date only")            
         
 
 
     def exists(self):
+        e = self._entry("")
+        if e is not UNKNOWN:
+            return e is not None
         return self.remotedirectory in self.cd("..").ls()
 
     def has(self, path):
-        return path in self.ls()       
+        e = self._entry(path)
+        if e is not UNKNOWN:
+            return e is not None
+        return path in self.ls()
         
     def append(self, file, strin):
-        f = self.open(file)
-        f.seek(0,2)
-        f.write(strin)
-        f.seek(0)
-        ftp = self._get_ftp()
-        ftp.storbinary('STOR %s'%os.path.join(self.remotedirectory,file), f)
+        with self.open(file, 'a') as f:
+            f.write(strin)
 
     def appendlines(self, file, lines):
-        f = self.open(file)
-        f.seek(0,2)
-        f.writelines(lines)
-        f.seek(0)
-        ftp = self._get_ftp()
-        ftp.storlines('STOR %s'%os.path.join(self.remotedirectory,file), f)
+        with self.open(file, 'a') as f:
+            f.writelines(lines)
 
     def isfile(self, filename):
-        ftp = self._get_ftp()
-        filename = ftp_path2path(ftp, filename)     
-        return ftp_isfile(ftp, os.path.join(self.remotedirectory, filename))    
+        filename = ftp_path2path(self.ftp, filename)     
+        e = self._entry(filename)
+        if e is not UNKNOWN:
+            return e is not None and e.isfile
+        with self._get_ftp() as ftp:
+            return ftp_isfile(ftp, os.path.join(self.remotedirectory, filename))    
 
     def isdir(self, dirname):
-        ftp = self._get_ftp()
-        dirname = ftp_path2path(ftp, dirname)
-        return not ftp_isfile(ftp, os.path.join(self.remotedirectory, dirname))                   
+        dirname = ftp_path2path(self.ftp, dirname)
+        e = self._entry(dirname)
+        if e is not UNKNOWN:
+            return e is not None and e.isdir
+        with self._get_ftp() as ftp:
+            return not ftp_isfile(ftp, os.path.join(self.remotedirectory, dirname))                   
 
     def _path(self, relpath, ftp):
         ftppath  = os.path.join(self.remotedirectory, relpath)
@@ -225,28 +421,31 @@ class FtpDirectory(LocalDirectory):
         return dpath(*path)
 
     def makedirs(self, d):
-        ftp = self._get_ftp()
-        d = ftp_path2path(ftp,d)        
-        ftp_makedirs(ftp, os.path.join(self.remotedirectory,d), True)
+        d = os.path.join(self.remotedirectory, ftp_path2path(self.ftp, d))
+        try:
+            with self._get_ftp() as ftp:
+                ftp_makedirs(ftp, d, True)
+        finally:
+            ftp_cache(self.ftp).invalidate(d, parents=True)
 
     def build(self):
-        ftp = self._get_ftp()
-        ftp_makedirs(ftp, self.remotedirectory, True)
-        return 
-
         try:
-            ftp_makedirs(ftp, self.remotedirectory, True)
-        except error_perm as e:
-            if "550" in str(e)[:4]:
-                if ftp_isfile(ftp, self.remotedirectory):
-                    raise OSError("[Errno %d] File exists: '%s'"%(os.errno.ENOTDIR, self.directory))                                    
-            else:
-                raise error_perm(e)
-        return self    
+            with self._get_ftp() as ftp:
+                ftp_makedirs(ftp, self.remotedirectory, True)
+        finally:
+            ftp_cache(self.ftp).invalidate(self.remotedirectory, parents=True)
     
     def check(self):
-        ftp = self._get_ftp()
-        return ftp_exists(ftp, self.remotedirectory) and  not ftp_isfile(ftp, self.remotedirectory)
+        e = self._entry("")
+        if e is not UNKNOWN:
+            return e is not None and e.isdir
+        with self._get_ftp() as ftp:
+            return ftp_exists(ftp, self.remotedirectory) and  not ftp_isfile(ftp, self.remotedirectory)
+
+    def refresh(self, file=''):
+        """ forget the cached listings of file (its parent, itself and its sub-directories) """
+        file = ftp_path2path(self.ftp, file)
+        ftp_cache(self.ftp).invalidate(os.path.join(self.remotedirectory, file))
 
 
 ######################################################
@@ -275,30 +474,32 @@ class FtpFile(StringIO):
 
     if _P3:
         def _ftpread(self):
-            ftp = self.ftp
             strout = BytesIO()
-            ftp.retrbinary("RETR %s"%(self.file), strout.write)
+            with ftp_lease(self.ftp) as ftp:
+                ftp.retrbinary("RETR %s"%(self.file), strout.write)
             strout.seek(0)
             return strout.read().decode()
     else:
         def _ftpread(self):
-            ftp = self.ftp
             strout = StringIO()
-            ftp.retrbinary("RETR %s"%(self.file), strout.write)
+            with ftp_lease(self.ftp) as ftp:
+                ftp.retrbinary("RETR %s"%(self.file), strout.write)
             strout.seek(0)
             return strout.read()
 
     if _P3:
         def _ftpwrite(self, strin):
             f = BytesIO(strin.encode())
-            ftp = self.ftp            
-            ftp.storbinary('STOR %s'%(self.file), f) 
+            with ftp_lease(self.ftp) as ftp:
+                ftp.storbinary('STOR %s'%(self.file), f) 
+            ftp_cache(self.ftp).invalidate(self.file)
 
     else:
         def _ftpwrite(self, strin):
             f = StringIO(strin)
-            ftp = self.ftp
-            ftp.storbinary('STOR %s'%(self.file), f)            
+            with ftp_lease(self.ftp) as ftp:
+                ftp.storbinary('STOR %s'%(self.file), f)            
+            ftp_cache(self.ftp).invalidate(self.file)
 
     def close(self):
         mode = self.mode
@@ -350,16 +551,17 @@ if _P3:
 
         
         def _ftpread(self):
-            ftp = self.ftp
             strout = BytesIO()
-            ftp.retrbinary("RETR %s"%(self.file), strout.write)
+            with ftp_lease(self.ftp) as ftp:
+                ftp.retrbinary("RETR %s"%(self.file), strout.write)
             strout.seek(0)
             return strout.read()
     
         def _ftpwrite(self, bytesin):
             f = BytesIO(bytesin)
-            ftp = self.ftp            
-            ftp.storbinary('STOR %s'%(self.file), f) 
+            with ftp_lease(self.ftp) as ftp:
+                ftp.storbinary('STOR %s'%(self.file), f) 
+            ftp_cache(self.ftp).invalidate(self.file)
 
         def close(self):
             mode = self.mode
@@ -386,6 +588,146 @@ if _P3:
             return self        
 
 
+class FtpRawIO(io.RawIOBase):
+    """ Raw binary stream over the data connection of a ftp transfer command
+
+    The ftp connection is held until the stream is closed. If ftp is a FtpPool
+    a dedicated connection is leased, otherwhise the single connection should
+    not be used by other commands while the file is open.
+    """
+    def __init__(self, ftp, file, cmd, rest=None):
+        io.RawIOBase.__init__(self)
+        self.ftp = ftp
+        self.file = file
+        self.cmd = cmd
+        self.rest = rest
+        self._sock = None
+        self._conn = None
+
+    def __repr__(self):
+        return "<stream file '%s' in ftp '%s', %s at %0x>"%(self.file, self.ftp.host, self.cmd, id(self))
+
+    @property
+    def name(self):
+        return self.file
+
+    def _open(self):
+        """ send the transfer command and open the data connection """
+        if isinstance(self.ftp, FtpPool):
+            self._conn = self.ftp.acquire(shared=False)
+        else:
+            self._conn = self.ftp
+        try:
+            with ftp_lock(self._conn):
+                self._conn.voidcmd("TYPE I")
+                self._sock = self._conn.transfercmd("%s %s"%(self.cmd, self.file), self.rest)
+        except error_perm:
+            self._release(False)
+            raise
+        except:
+            self._release(True)
+            raise
+
+    def _release(self, broken):
+        conn, self._conn = self._conn, None
+        if conn is not None and isinstance(self.ftp, FtpPool):
+            self.ftp.release(conn, broken)
+
+    def close(self):
+        if self.closed:
+            return
+        broken = False
+        try:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+                with ftp_lock(self._conn):
+                    try:
+                        self._conn.voidresp()
+                    except (error_temp, error_perm):
+                        if self.writable():
+                            raise
+                        ## read transfer aborted because closed before the end 
+        except (error_temp, error_perm):
+            raise
+        except all_errors:
+            broken = True
+            raise
+        finally:
+            self._release(broken)
+            io.RawIOBase.close(self)
+
+
+class FtpRawReader(FtpRawIO):
+    """ Raw binary reader of a remote file streamed from the RETR data connection 
+
+    rest is an optional offset where to start the transfer.
+    """
+    def __init__(self, ftp, file, rest=None):
+        FtpRawIO.__init__(self, ftp, file, "RETR", rest)
+        self._open()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self._sock.recv_into(b)
+
+
+class FtpRawWriter(FtpRawIO):
+    """ Raw binary writer sending the data to a remote file as they are written
+
+    The STOR (or APPE if append is True) data connection is open at the first 
+    write. The transfer is completed when the writer is closed.
+    """
+    def __init__(self, ftp, file, append=False):
+        FtpRawIO.__init__(self, ftp, file, "APPE" if append else "STOR")
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self._sock is None:
+            self._open()
+        self._sock.sendall(b)
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            ## an empty file must be created anyway
+            if self._sock is None:
+                self._open()
+            FtpRawIO.close(self)
+        finally:
+            ftp_cache(self.ftp).invalidate(self.file)
+
+
+def ftp_open_reader(ftp, file, mode='rb', rest=None, buffering=BLOCKSIZE, encoding="utf-8"):
+    """ open a remote file for streaming reads
+
+    Return a buffered binary reader or, if 'b' is not in mode, a text reader 
+    decoding the data on the fly. 
+    """
+    f = io.BufferedReader(FtpRawReader(ftp, file, rest), buffering)
+    if 'b' in mode or not _P3:
+        return f
+    return io.TextIOWrapper(f, encoding, newline="\n")
+
+def ftp_open_writer(ftp, file, mode='wb', buffering=BLOCKSIZE, encoding="utf-8"):
+    """ open a remote file for streaming writes ('w') or appends ('a')
+
+    Data are sent by blocks of buffering bytes, at most one block is kept in 
+    memory. Return a buffered binary writer or, if 'b' is not in mode, a 
+    text writer encoding the data on the fly.
+    """
+    f = io.BufferedWriter(FtpRawWriter(ftp, file, 'a' in mode), buffering)
+    if 'b' in mode or not _P3:
+        return f
+    return io.TextIOWrapper(f, encoding, newline="\n")
+
+
 #####################################################################
 #
 #  FTP high level functions 
@@ -480,6 +822,16 @@ def ftp_isfile(ftp, path):
         return False
     return len(lst)==1 and lst[0]==path
 
+## types of the listing entries whose type is asked name by name : the 
+## symbolic links and the names of a NLST (see ftp_nlst_entries)
+_UNTYPED = ('link', 'unknown')
+
+def _ftp_resolve(ftp, path, e):
+    """ return the entry of a symbolic link (or a NLST name) with the type of its target """
+    tpe = 'file' if ftp_isfile(ftp, path) else 'dir'
+    cls = link_entry if e.type == 'link' else entry
+    return cls(e.name, tpe, e.size if tpe=='file' else None, e.mtime)
+
 def ftp_exists(ftp, path):
     _, d = os.path.split(path)    
     return d in [os.path.split(s)[1] for s in ftp.nlst(os.path.join(path, ".."))]
@@ -616,17 +968,138 @@ def ftp_get(ftp, remote, local):
         ftp.retrbinary("RETR %s"%(remote),f.write)
     return local    
 
-def ftp_mget(ftp, remotes, localdir):
+def ftp_resume(ftp, remote, local):
+    """ download remote into local, a partial local copy is continued with REST
+
+    The local copy is considered complete if it has the remote size (SIZE), 
+    it is downloaded again if it is larger. 
+    """
+    ftp.voidcmd("TYPE I")
+    try:
+        size = ftp.size(remote)
+    except error_perm: # SIZE not supported
+        size = None
+    offset = os.path.getsize(local) if os.path.exists(local) else 0
+    if size is None or offset > size:
+        offset = 0
+    elif offset == size:
+        log.notice("file %s already complete"%local)
+        return local
+    if offset:
+        log.notice("resuming %s at byte %d"%(local, offset))
+    with open(local, "ab" if offset else "wb") as f:
+        ftp.retrbinary("RETR %s"%(remote), f.write, rest=offset or None)
+    return local
+
+
+class FtpJournal(object):
+    """ On-disk journal of the files completed by a batch transfer
+
+    Each completed file is recorded with its size in a text file so that a 
+    batch interrupted (e.g. crash) can be restarted without transferring the 
+    completed files again. The journal is removed by the batch when all files
+    are transferred.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    size, _, remote = line.rstrip("\n").partition(" ")
+                    if remote and size.isdigit():
+                        self.done[remote] = int(size)
+
+    def isdone(self, remote, local):
+        """ True if remote is recorded and local has the recorded size """
+        size = self.done.get(remote)
+        return size is not None and os.path.exists(local) and os.path.getsize(local) == size
+
+    def add(self, remote, local):
+        """ record remote as completed in local """
+        size = os.path.getsize(local)
+        with self._lock:
+            self.done[remote] = size
+            with open(self.path, "a") as f:
+                f.write("%d %s\n"%(size, remote))
+
+    def clear(self):
+        """ remove the journal file """
+        with self._lock:
+            self.done = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+def ftp_mget(ftp, remotes, localdir, workers=1, errors=None, resume=False):
+    """ download remote files inside localdir and return the list of local path
+
+    ftp is a ftp connection or a FtpPool. remotes is a glob or a list of remote 
+    path. 
+    With workers>1 the files are taken from a shared queue by workers threads,
+    each file is downloaded on a connection leased from the pool (a single ftp 
+    connection is shared by the threads one file at a time). 
+    If errors is a list, the (remote, exception) of the failed files are 
+    appended and the other files are still downloaded, otherwhise the first 
+    error is raised at the end of the batch.
+    If resume is True, partial local files are continued (see ftp_resume) and 
+    the completed files are recorded in a journal inside localdir, so an 
+    interrupted batch restart where it stopped.
+    """
     if isinstance(remotes, basestring):
-        files = ftp_ls(ftp, remotes)
+        with ftp_lease(ftp) as c:
+            files = ftp_ls(c, remotes)
     else:
         files = list(remotes)
 
-    lst = []    
-    for remote in files:
-        _, name = os.path.split(remote)
-        lst.append(ftp_get(ftp, remote, os.path.join(localdir, name)))
-    return lst    
+    results = [None]*len(files)
+    failed = []
+    queue = Queue()
+    for i, remote in enumerate(files):
+        queue.put((i, remote))
+    journal = FtpJournal(os.path.join(localdir, JOURNAL)) if resume else None
+
+    def work():
+        while True:
+            try:
+                i, remote = queue.get_nowait()
+            except Empty:
+                return
+            _, name = os.path.split(remote)
+            local = os.path.join(localdir, name)
+            try:
+                if journal is None:
+                    with ftp_lease(ftp, shared=False) as c:
+                        results[i] = ftp_get(c, remote, local)
+                elif journal.isdone(remote, local):
+                    results[i] = local
+                else:
+                    with ftp_lease(ftp, shared=False) as c:
+                        results[i] = ftp_resume(c, remote, local)
+                    journal.add(remote, local)
+            except all_errors as e:
+                log.error("cannot get '%s': %s"%(remote, e))
+                failed.append((i, remote, e))
+
+    workers = max(1, min(workers, len(files)))
+    if workers == 1:
+        work()
+    else:
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+
+    if journal is not None and not failed:
+        journal.clear()
+    failed.sort(key=lambda f: f[0])
+    if errors is not None:
+        errors.extend((remote, e) for _, remote, e in failed)
+    elif failed:
+        raise failed[0][2]
+    return [r for r in results if r is not None]
 
 def ftp_mput(ftp, flocals, remotedir):
     if isinstance(flocals, basestring):
@@ -691,6 +1164,10 @@ def ftp_transfer_files(ftp,  files, localdir= "", distdir="", verbose=VERBOSE, f
     distdir is the distant root ftp directory starting point, is equivalent
     to do a ftp.cwd( distdir) to change directory.
 
+    If force is False, the transfer is resumed: partial local files are 
+    continued with REST and files recorded in the journal of localdir 
+    (completed by a previous interrupted call) are skipped.
+
     Return the list of local path to files
     """
     if os.path.exists(localdir):
@@ -701,9 +1178,8 @@ def ftp_transfer_files(ftp,  files, localdir= "", distdir="", verbose=VERBOSE, f
     if distdir and distdir!="":
         ftp.cwd(distdir)
 
-    global _ftpfinished
-    global _ftpwrfunc
-
+    journal = None if force else FtpJournal(os.path.join(localdir, JOURNAL))
+    complete = True
 
     outlist = []
     for path in files:
@@ -713,16 +1189,23 @@ def ftp_transfer_files(ftp,  files, localdir= "", distdir="", verbose=VERBOSE, f
         create_dir(subdir, localdir, verbose=verbose)
         localpath = os.path.join(localdir, subdir, fl)
 
-        if not force and os.path.exists(localpath):
-            log.notice("file %s already exists use force=True to force download"%(localpath))
+        if journal is not None and journal.isdone(path, localpath):
+            log.notice("file %s already transfered use force=True to force download"%(localpath))
         else:
             log.notice("FTP: Copying file %s:%s to %s "%(ftp.host, fl, localdir+subdir))
 
             try:
-                ftp.retrbinary("RETR %s"%(path),open(localpath, "wb").write)
+                if journal is None:
+                    ftp_get(ftp, path, localpath)
+                else:
+                    ftp_resume(ftp, path, localpath)
+                    journal.add(path, localpath)
             except error_perm:
+                complete = False
                 log.warning("wrong permition for transfert %s"%path)    
         outlist.append( localpath )
+    if journal is not None and complete:
+        journal.clear()
     return outlist
 
 
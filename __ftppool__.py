@@ -0,0 +1,316 @@
+#####
+# Pool of logged-in ftp connections shared by all the dpath/fpath of a same
+# (host, port, user).
+#
+# A connection is leased for one operation and given back to the pool
+# afterward, so several threads can use paths of the same root in parallel
+# without mixing their commands on a control connection.
+######
+from .shared import log
+from ftplib import FTP, error_temp, error_reply, error_proto
+from contextlib import contextmanager
+import threading
+import socket
+import time
+
+## default size and timing of the pools
+POOL_MINSIZE = 1
+POOL_MAXSIZE = 4
+POOL_IDLE_TIMEOUT = 60.0 # close idle connections after this many seconds
+POOL_CHECK_AFTER = 10.0  # send a NOOP to connections idle for longer than that
+
+## errors after which the connection cannot be used anymore
+_BROKEN_ERRORS = (socket.error, IOError, EOFError, error_reply, error_proto)
+## ftplib.FTP methods which cannot be run on a leased connection
+_NOT_PROXIED = ("connect", "set_debuglevel", "debug", "set_pasv")
+
+
+class FtpPool(object):
+    """ A thread safe pool of ftp connections logged on the same server
+
+    Connections are created on demand up to maxsize, the pool keeps at least
+    minsize connections alive. Idle connections are closed after idle_timeout
+    seconds and checked with a NOOP before being reused if they were idle
+    for more than check_after seconds.
+
+        >>> pool = FtpPool("server.com", 21, "user", "password")
+        >>> with pool.lease() as ftp:
+        ...     ftp.nlst()
+
+    A lease is reentrant: nested leases in the same thread get the same
+    connection.
+    """
+    def __init__(self, host, port=0, username=None, password=None,
+                 minsize=None, maxsize=None, idle_timeout=None, check_after=None,
+                 timeout=None):
+        self.host = host
+        self.port = port or 0
+        self.username = username
+        self.password = password
+        self.minsize = POOL_MINSIZE if minsize is None else minsize
+        self.maxsize = POOL_MAXSIZE if maxsize is None else maxsize
+        self.idle_timeout = POOL_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.check_after = POOL_CHECK_AFTER if check_after is None else check_after
+        self.timeout = timeout
+
+        if self.maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = [] # list of (ftp, last_used_time)
+        self._size = 0  # number of connections idle, leased or being created
+        self._local = threading.local()
+
+    def __repr__(self):
+        return "<FtpPool '%s%s:%d' %d/%d connections at %0x>"%(
+                self.username+"@" if self.username else "", self.host, self.port,
+                self._size, self.maxsize, id(self))
+
+    @property
+    def size(self):
+        """ number of connections currently open by the pool """
+        return self._size
+
+    def _connect(self):
+        ftp = FTP(timeout=self.timeout) if self.timeout else FTP()
+        ftp.connect(self.host, self.port)
+        if self.username:
+            ftp.login(self.username, self.password)
+        ## store the username in the ftp so it can recovered later
+        ftp.username = self.username
+        log.notice("new ftp connection to '%s'"%self.host)
+        return ftp
+
+    @staticmethod
+    def _close(ftp):
+        try:
+            ftp.quit()
+        except Exception:
+            ftp.close()
+
+    def _check(self, ftp):
+        try:
+            ftp.voidcmd("NOOP")
+        except Exception:
+            return False
+        return True
+
+    def _evict(self):
+        """ pop the idle connections unused for too long, must be called with the lock """
+        limit = time.time() - self.idle_timeout
+        evicted = []
+        while self._idle and self._size > self.minsize and self._idle[0][1] < limit:
+            evicted.append(self._idle.pop(0)[0])
+            self._size -= 1
+        return evicted
+
+    def _acquire(self, timeout=None):
+        end = None if timeout is None else time.time()+timeout
+        while True:
+            ftp = None
+            with self._cond:
+                evicted = self._evict()
+                while not self._idle and self._size >= self.maxsize:
+                    remaining = None if end is None else end-time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise error_temp("421 no ftp connection available for '%s'"%self.host)
+                    self._cond.wait(remaining)
+                if self._idle:
+                    ftp, last = self._idle.pop()
+                else:
+                    self._size += 1
+            for c in evicted:
+                self._close(c)
+
+            if ftp is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._discard(None)
+                    raise
+
+            if time.time()-last < self.check_after or self._check(ftp):
+                return ftp
+            log.notice("dropping dead ftp connection to '%s'"%self.host)
+            self._discard(ftp)
+
+    def _discard(self, ftp):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+        if ftp is not None:
+            self._close(ftp)
+
+    def acquire(self, timeout=None, shared=True):
+        """ return a ftp connection from the pool, it must be given back with release
+
+        If the maximum number of connections is reached, wait until one is released
+        or timeout (second) is over.
+        If shared is False, the connection is dedicated to the caller (e.g. for the 
+        data transfer of an open file) and is not reused by the nested leases of 
+        the thread.
+        """
+        if not shared:
+            return self._acquire(timeout)
+        local = self._local
+        if getattr(local, "ftp", None) is not None:
+            local.depth += 1
+            return local.ftp
+        ftp = self._acquire(timeout)
+        local.ftp, local.depth, local.broken = ftp, 1, False
+        return ftp
+
+    def release(self, ftp, broken=False):
+        """ give back a connection to the pool
+
+        if broken is True the connection is closed instead of being reused
+        """
+        local = self._local
+        if getattr(local, "ftp", None) is ftp:
+            local.broken = local.broken or broken
+            local.depth -= 1
+            if local.depth:
+                return
+            broken = local.broken
+            local.ftp = None
+
+        if broken:
+            self._discard(ftp)
+            return
+        with self._cond:
+            self._idle.append((ftp, time.time()))
+            self._cond.notify()
+
+    @contextmanager
+    def lease(self, timeout=None, shared=True):
+        """ context manager leasing a connection for the time of the with block """
+        ftp = self.acquire(timeout, shared)
+        broken = False
+        try:
+            yield ftp
+        except _BROKEN_ERRORS:
+            broken = True
+            raise
+        except error_temp as e:
+            broken = str(e)[:3] == "421"
+            raise
+        finally:
+            self.release(ftp, broken)
+
+    def warmup(self, n=None):
+        """ open and login connections in a background thread
+
+        n is the number of connections to reach, default is minsize
+        """
+        n = self.minsize if n is None else min(n, self.maxsize)
+        t = threading.Thread(target=self._fill, args=(n,))
+        t.daemon = True
+        t.start()
+        return t
+
+    def _fill(self, n):
+        while True:
+            with self._cond:
+                if self._size >= n:
+                    return
+                self._size += 1
+            try:
+                ftp = self._connect()
+            except Exception as e:
+                log.warning("cannot connect to '%s': %s"%(self.host, e))
+                self._discard(None)
+                return
+            with self._cond:
+                self._idle.append((ftp, time.time()))
+                self._cond.notify()
+
+    def __getattr__(self, attr):
+        """ the other methods of ftplib.FTP (nlst, size, sendcmd, ...) run on a leased connection
+
+        Commands changing the state of a connection (e.g. cwd) only affect the
+        connection of that call, the paths always send absolute paths.
+        """
+        if attr.startswith("_") or attr in _NOT_PROXIED or not callable(getattr(FTP, attr, None)):
+            raise AttributeError("'FtpPool' object has no attribute '%s'"%attr)
+        def method(*args, **kwargs):
+            with self.lease() as ftp:
+                return getattr(ftp, attr)(*args, **kwargs)
+        method.__name__ = attr
+        return method
+
+    def login(self, username, password):
+        """ change the login of the pool, idle connections are closed
+
+        The pool is moved to the key of the new login in the shared pools.
+        """
+        with _pools_lock:
+            for key, pool in list(_pools.items()):
+                if pool is self:
+                    del _pools[key]
+            _pools.setdefault((self.host, self.port, username, password), self)
+        self.username = username
+        self.password = password
+        self.clear()
+
+    def close(self):
+        """ close the idle connections, same as clear """
+        self.clear()
+    quit = close
+
+    def clear(self):
+        """ close all the idle connections """
+        with self._cond:
+            idle = [ftp for ftp, _ in self._idle]
+            self._idle = []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for ftp in idle:
+            self._close(ftp)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def ftp_pool(host, port=0, username=None, password=None, **kwargs):
+    """ return the shared FtpPool of (host, port, username, password), create it if needed
+
+    The password is part of the key, so a path with an other (e.g. corrected)
+    password does not reuse the connections logged with the first one.
+    A new pool start to login connections in background.
+    """
+    key = (host, port or 0, username, password)
+    with _pools_lock:
+        try:
+            return _pools[key]
+        except KeyError:
+            pool = _pools[key] = FtpPool(host, port, username, password, **kwargs)
+    pool.warmup()
+    return pool
+
+
+_locks_lock = threading.Lock()
+
+def ftp_lock(ftp):
+    """ the lock protecting the commands sent on a single ftp connection """
+    lock = getattr(ftp, "lock", None)
+    if lock is None:
+        with _locks_lock:
+            lock = getattr(ftp, "lock", None)
+            if lock is None:
+                lock = ftp.lock = threading.RLock()
+    return lock
+
+@contextmanager
+def ftp_lease(ftp, shared=True):
+    """ lease a connection from a FtpPool or lock a single ftp connection
+
+        >>> with ftp_lease(ftp) as c:
+        ...     c.nlst()
+    """
+    if isinstance(ftp, FtpPool):
+        with ftp.lease(shared=shared) as c:
+            yield c
+        return
+
+    with ftp_lock(ftp):
+        yield ftp
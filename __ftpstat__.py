@@ -0,0 +1,318 @@
+#####
+# Typed directory listing of a ftp connection.
+#
+# A directory is listed in one command with MLSD (RFC 3659) and, if the server
+# does not know MLSD, with the Unix-style output of LIST. Each item is returned
+# as an entry(name, type, size, mtime) so that the type, size and modification
+# time of all the files of a directory cost only one round trip.
+######
+from .shared import log, entry
+from ftplib import error_perm, error_temp
+from collections import OrderedDict
+import posixpath
+import threading
+import calendar
+import time
+
+## ftp reply codes meaning that the command is not understood by the server
+_UNKNOWN_CODES = ("500", "501", "502", "504")
+
+_MONTHS = dict((m, i+1) for i, m in enumerate(["jan", "feb", "mar", "apr", "may", "jun",
+                                                "jul", "aug", "sep", "oct", "nov", "dec"]))
+
+def ftp_time(t):
+    """ convert a ftp time 'YYYYMMDDHHMMSS[.sss]' (UTC) to a timestamp """
+    t = t.strip()
+    frac = 0.0
+    if "." in t:
+        t, f = t.split(".", 1)
+        frac = float("0."+f) if f.isdigit() else 0.0
+    return calendar.timegm(time.strptime(t, "%Y%m%d%H%M%S")) + frac
+
+def parse_mlsd_line(line):
+    """ parse one line of a MLSD output and return an entry or None
+
+    None is returned for the current and parent directory ('cdir', 'pdir')
+    """
+    facts, _, name = line.partition(" ")
+    if not name:
+        return None
+    fdict = {}
+    for fact in facts.split(";"):
+        k, _, v = fact.partition("=")
+        if k:
+            fdict[k.lower()] = v
+
+    tpe = fdict.get("type", "file").lower()
+    if tpe in ("cdir", "pdir") or name in (".", ".."):
+        return None
+    if tpe not in ("dir", "file"):
+        ## e.g. 'OS.unix=slink:/target' for a symbolic link
+        tpe = "link" if "slink" in tpe else "file"
+
+    size = fdict.get("size", fdict.get("sizd"))
+    size = int(size) if size and size.isdigit() else None
+    mtime = fdict.get("modify")
+    try:
+        mtime = ftp_time(mtime) if mtime else None
+    except ValueError:
+        mtime = None
+    return entry(name, tpe, size, mtime)
+
+def _list_time(month, day, yeartime):
+    month = _MONTHS.get(month[:3].lower())
+    if month is None or not day.isdigit():
+        return None
+    if ":" in yeartime:
+        h, m = yeartime.split(":", 1)
+        now = time.gmtime()
+        year = now.tm_year
+        t = calendar.timegm((year, month, int(day), int(h), int(m), 0))
+        ## without year the date is within the last 6 months
+        if t > calendar.timegm(now) + 86400:
+            t = calendar.timegm((year-1, month, int(day), int(h), int(m), 0))
+        return t
+    if yeartime.isdigit():
+        return calendar.timegm((int(yeartime), month, int(day), 0, 0, 0))
+    return None
+
+def parse_list_line(line):
+    """ parse one line of a Unix-style LIST output and return an entry or None
+
+    e.g. : 'drwxr-xr-x   2 user  group   4096 Jan 01 12:00 name'
+    None is returned for lines that cannot be parsed (e.g. 'total 12')
+    """
+    items = line.split(None, 8)
+    if len(items) < 9 or not items[4].isdigit():
+        return None
+    perms, _, _, _, size, month, day, yeartime, name = items
+    if name in (".", ".."):
+        return None
+    flag = perms[0]
+    if flag == "d":
+        tpe = "dir"
+    elif flag == "l":
+        tpe = "link"
+        name = name.split(" -> ", 1)[0]
+    else:
+        tpe = "file"
+    return entry(name, tpe, int(size), _list_time(month, day, yeartime))
+
+def ftp_mlsd(ftp, path=""):
+    """ list a directory with MLSD and return a list of entry """
+    lines = []
+    ftp.retrlines("MLSD %s"%path if path else "MLSD", lines.append)
+    return [e for e in (parse_mlsd_line(l) for l in lines) if e is not None]
+
+def ftp_list(ftp, path=""):
+    """ list a directory with LIST and return a list of entry 
+
+    If no line of a non-empty output can be parsed (e.g. a DOS-style LIST),
+    the names are listed with NLST, see ftp_nlst_entries.
+    """
+    lines = []
+    ftp.retrlines("LIST %s"%path if path else "LIST", lines.append)
+    entries = [e for e in (parse_list_line(l) for l in lines) if e is not None]
+    if lines and not entries:
+        return ftp_nlst_entries(ftp, path)
+    return entries
+
+def ftp_nlst_entries(ftp, path=""):
+    """ list a directory with NLST and return a list of entry of type 'unknown'
+
+    Used when the LIST output cannot be parsed, the type of these names is 
+    asked one by one when needed.
+    """
+    log.notice("cannot parse the LIST output of '%s', using NLST"%ftp.host)
+    try:
+        names = ftp.nlst(path) if path else ftp.nlst()
+    except error_perm as e:
+        if str(e)[:3] == "450": # empty directory on some servers
+            return []
+        raise
+    entries = []
+    for name in names:
+        name = posixpath.basename(name.rstrip("/"))
+        if name and name not in (".", ".."):
+            entries.append(entry(name, 'unknown'))
+    return entries
+
+def ftp_iterlines(ftp, cmd):
+    """ iterator version of ftp.retrlines, yield the lines as they arrive
+
+    The transfer is aborted if the iterator is closed before the end. The 
+    connection cannot be used for an other command until the iteration is 
+    over.
+    """
+    ftp.sendcmd("TYPE A")
+    conn = ftp.transfercmd(cmd)
+    maxline = getattr(ftp, "maxline", 8192)
+    done = False
+    try:
+        fp = conn.makefile('r', encoding=ftp.encoding) if hasattr(ftp, "encoding") else conn.makefile('rb')
+        try:
+            while True:
+                line = fp.readline(maxline+1)
+                if not line:
+                    break
+                if line[-2:] == "\r\n":
+                    line = line[:-2]
+                elif line[-1:] == "\n":
+                    line = line[:-1]
+                yield line
+            done = True
+        finally:
+            fp.close()
+    finally:
+        conn.close()
+        try:
+            ftp.voidresp()
+        except (error_temp, error_perm):
+            ## '426 transfer aborted' when closed before the end
+            if done:
+                raise
+
+def ftp_iterscan(ftp, path=""):
+    """ iterator version of ftp_scan, yield the entry of a directory as they arrive """
+    if getattr(ftp, "mlsd_support", True):
+        lines = ftp_iterlines(ftp, "MLSD %s"%path if path else "MLSD")
+        try:
+            ## the command is sent at the first step
+            first = next(lines, None)
+        except error_perm as e:
+            if str(e)[:3] not in _UNKNOWN_CODES:
+                raise
+            log.notice("MLSD not supported by '%s', using LIST"%ftp.host)
+            ftp.mlsd_support = False
+        else:
+            if first is None:
+                return
+            e = parse_mlsd_line(first)
+            if e is not None:
+                yield e
+            for line in lines:
+                e = parse_mlsd_line(line)
+                if e is not None:
+                    yield e
+            return
+    lines = parsed = 0
+    for line in ftp_iterlines(ftp, "LIST %s"%path if path else "LIST"):
+        lines += 1
+        e = parse_list_line(line)
+        if e is not None:
+            parsed += 1
+            yield e
+    if lines and not parsed:
+        ## the transfer is over, the connection can be used for NLST
+        for e in ftp_nlst_entries(ftp, path):
+            yield e
+
+def ftp_scan(ftp, path=""):
+    """ list a directory in one command and return a list of entry
+
+    MLSD is used if the server support it, LIST otherwhise. The result is
+    remembered in the ftp object so MLSD is tried only once per connection.
+    """
+    if getattr(ftp, "mlsd_support", True):
+        try:
+            return ftp_mlsd(ftp, path)
+        except error_perm as e:
+            if str(e)[:3] not in _UNKNOWN_CODES:
+                raise
+            log.notice("MLSD not supported by '%s', using LIST"%ftp.host)
+            ftp.mlsd_support = False
+    return ftp_list(ftp, path)
+
+
+#####
+# Cache of the directory listings
+#
+# All the metadata (existence, type, size, mtime) of the ftp paths are read from
+# the listing of their parent directory. Listings are kept in a cache attached to
+# the connection (a FtpPool or a ftp object) for CACHE_TTL seconds. Writes,
+# deletes and mkdirs made through the paths invalidate the concerned listings.
+######
+
+## time to live in seconds of a cached listing, 0 disable the cache
+CACHE_TTL = 30.0
+## maximum number of directory listings kept per connection
+CACHE_SIZE = 1024
+
+
+class FtpCache(object):
+    """ TTL'd and size bounded cache of the directory listings of a connection 
+
+    The least recently used listings are dropped when maxsize is reached.
+    """
+    def __init__(self, ttl=None, maxsize=None):
+        self.ttl = CACHE_TTL if ttl is None else ttl
+        self.maxsize = CACHE_SIZE if maxsize is None else maxsize
+        self._lock = threading.Lock()
+        self._listings = OrderedDict() # path -> (time, entries)
+
+    def __len__(self):
+        return len(self._listings)
+
+    @staticmethod
+    def _key(path):
+        return posixpath.normpath(path or ".")
+
+    def get(self, path):
+        """ return the cached list of entry of a directory or None """
+        key = self._key(path)
+        with self._lock:
+            try:
+                t, entries = self._listings.pop(key)
+            except KeyError:
+                return None
+            if time.time()-t > self.ttl:
+                return None
+            self._listings[key] = (t, entries) # now the most recent
+        return entries
+
+    def set(self, path, entries):
+        """ store the list of entry of a directory """
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        key = self._key(path)
+        with self._lock:
+            self._listings.pop(key, None)
+            self._listings[key] = (time.time(), entries)
+            while len(self._listings) > self.maxsize:
+                self._listings.popitem(last=False)
+
+    def invalidate(self, path, parents=False):
+        """ forget what is known about path 
+
+        The listing of its parent directory and the listings of path and its
+        sub-directories are dropped. With parents=True the listings of all the 
+        parents are dropped (e.g. after a makedirs).
+        """
+        key = self._key(path)
+        drop = set([posixpath.dirname(key) or "."])
+        if parents:
+            p = key
+            while p not in ("", ".", "/"):
+                p = posixpath.dirname(p)
+                drop.add(p or ".")
+        with self._lock:
+            for k in list(self._listings):
+                if k in drop or k == key or k.startswith(key+"/"):
+                    del self._listings[k]
+
+    def clear(self):
+        with self._lock:
+            self._listings.clear()
+
+
+_cache_lock = threading.Lock()
+
+def ftp_cache(ftp):
+    """ the FtpCache attached to a connection (a FtpPool or a ftp object) """
+    cache = getattr(ftp, "cache", None)
+    if cache is None:
+        with _cache_lock:
+            cache = getattr(ftp, "cache", None)
+            if cache is None:
+                cache = ftp.cache = FtpCache()
+    return cache
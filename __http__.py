@@ -1,40 +1,248 @@
 ## experimental 
 # uQvwg63reC%u
 from __future__ import print_function
-from .shared import log, scheme_lookup, connection
+from .shared import log, scheme_lookup, connection, entry, walk_scan, iterglob, compile_glob
 from .__local__ import LocalDirectory
 from ftplib import FTP, error_perm, error_temp, all_errors
 
 try:
-    from urlparse import urlsplit, urlparse #python 2.7
+    from urlparse import urlsplit, urlparse, urljoin #python 2.7
 except:
-    from urllib.parse import urlsplit, urlparse
+    from urllib.parse import urlsplit, urlparse, urljoin
 
 
+from collections import OrderedDict
+import threading
+import posixpath
 import time
 import glob
 import os
+import io
+import re
 try:
-    from StringIO import StringIO # python 2.7
-except:
-    from io import StringIO
+    from html import unescape
+except ImportError: # python 2.7
+    from HTMLParser import HTMLParser
+    unescape = HTMLParser().unescape
+try:
+    unicode # python 2.7
+    _P3 = False
+except NameError:
+    _P3 = True
 
 
-from bs4 import BeautifulSoup
 import requests
+from requests.adapters import HTTPAdapter
+try:
+    from urllib3.util.retry import Retry
+except ImportError:
+    from requests.packages.urllib3.util.retry import Retry
+
+
+#####
+# Sessions shared by all the http paths of a same (scheme, host, port)
+#
+# A requests.Session keeps its connections alive, so the pages and files of a
+# server are fetched on a few TCP connections instead of one per request. 
+# Failed requests (connection errors, 502, 503, 504) are retried.
+######
+
+## buffer size of the files streamed from http
+BLOCKSIZE = 64*1024
+
+## default size and retries of the sessions
+HTTP_POOL_MAXSIZE = 10 # connections kept alive per host
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5 # wait 0.5, 1, 2, ... seconds between the retries
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def _session_key(url):
+    url = urlsplit(url)
+    return (url.scheme, url.hostname, url.port)
+
+def _mount(session, url, retries, maxsize, backoff):
+    retry = Retry(total=retries, backoff_factor=backoff, 
+                  status_forcelist=(502, 503, 504), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=maxsize, max_retries=retry)
+    scheme, _, _ = _session_key(url)
+    session.mount("%s://"%(scheme or "http"), adapter)
+
+def http_session(url, retries=None, maxsize=None, backoff=None):
+    """ the requests.Session shared by all the paths of the server of url
+
+    The session is created on first use. If retries, maxsize or backoff are 
+    given the session of the server is reconfigured with them:
+
+        >>> http_session("http://server.com", retries=10)
+    """
+    key = _session_key(url)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = requests.Session()
+        elif retries is None and maxsize is None and backoff is None:
+            return session
+        _mount(session, url, 
+               HTTP_RETRIES if retries is None else retries, 
+               HTTP_POOL_MAXSIZE if maxsize is None else maxsize, 
+               HTTP_BACKOFF if backoff is None else backoff)
+    return session
+
+def _session(http):
+    """ the session used to fetch the pages of the root response http """
+    session = getattr(http, "session", None)
+    if session is None:
+        session = http.session = http_session(http.url)
+    return session
+
+
+#####
+# Cache of the links of the http pages
+#
+# The links of a directory page are kept in a cache shared by all the http 
+# paths for HTTP_CACHE_TTL seconds. After that the page is requested again 
+# with If-None-Match/If-Modified-Since, a '304 Not Modified' answer keeps the 
+# cached links for an other HTTP_CACHE_TTL seconds without download and parsing.
+######
+
+## time to live in seconds of a cached page, 0 disable the cache
+HTTP_CACHE_TTL = 30.0
+## maximum number of pages kept in the cache
+HTTP_CACHE_SIZE = 1024
+
+
+class HttpCache(object):
+    """ TTL'd and size bounded cache of the links of http pages, keyed by url
+
+    The least recently used pages are dropped when maxsize is reached. The 
+    expired pages are kept with their ETag and Last-Modified headers to be 
+    revalidated. A page is parsed on the first get.
+    """
+    def __init__(self, ttl=None, maxsize=None):
+        self.ttl = HTTP_CACHE_TTL if ttl is None else ttl
+        self.maxsize = HTTP_CACHE_SIZE if maxsize is None else maxsize
+        self._lock = threading.Lock()
+        self._pages = OrderedDict() # url -> [time, etag, last_modified, links, response]
+
+    def __len__(self):
+        return len(self._pages)
+
+    @staticmethod
+    def _key(url):
+        return url.rstrip("/")
+
+    def get(self, url):
+        """ return the (hrefs, srcs) of a page if cached and not expired, or None """
+        key = self._key(url)
+        with self._lock:
+            page = self._pages.pop(key, None)
+            if page is None:
+                return None
+            self._pages[key] = page # now the most recent
+            if time.time()-page[0] > self.ttl:
+                return None
+            links, response = page[3], page[4]
+        if links is None:
+            links = http_links(response)
+            with self._lock:
+                page[3], page[4] = links, None
+        return links
+
+    def validators(self, url):
+        """ the headers of a conditional request of a cached page (expired or not) """
+        headers = {}
+        with self._lock:
+            page = self._pages.get(self._key(url))
+            if page is not None:
+                if page[1]:
+                    headers["If-None-Match"] = page[1]
+                if page[2]:
+                    headers["If-Modified-Since"] = page[2]
+        return headers
+
+    def refresh(self, url):
+        """ restart the time to live of a page (e.g. not modified), False if not cached """
+        with self._lock:
+            page = self._pages.get(self._key(url))
+            if page is None:
+                return False
+            page[0] = time.time()
+        return True
+
+    def set(self, url, response, links=None):
+        """ store a page from its requests response, if it was successful """
+        if self.ttl <= 0 or self.maxsize <= 0 or response.status_code != 200:
+            return
+        headers = response.headers
+        page = [time.time(), headers.get("ETag"), headers.get("Last-Modified"), 
+                links, None if links is not None else response]
+        key = self._key(url)
+        with self._lock:
+            self._pages.pop(key, None)
+            self._pages[key] = page
+            while len(self._pages) > self.maxsize:
+                self._pages.popitem(last=False)
+
+    def invalidate(self, url):
+        """ forget the page of url """
+        with self._lock:
+            self._pages.pop(self._key(url), None)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+## the cache of all the http paths, e.g. http_cache.ttl = 300
+http_cache = HttpCache()
+
+
+def http_page(session, url):
+    """ request the page of url, return the response
+
+    If the page is cached the request is conditional, a '304 Not Modified' 
+    response refreshes the cached page. A new page replaces the cached one.
+    """
+    r = session.get(url, headers=http_cache.validators(url))
+    if r.status_code == 304:
+        if http_cache.refresh(url):
+            return r
+        r = session.get(url)
+    http_cache.set(url, r)
+    return r
+
+def http_listing(http, url):
+    """ the (hrefs, srcs) of the page of url, from the cache if possible """
+    links = http_cache.get(url)
+    if links is None:
+        r = http_page(_session(http), url)
+        links = http_cache.get(url)
+        if links is None: # the page is not cached (error, cache disabled)
+            if r.status_code == 304:
+                r = _session(http).get(url)
+            links = http_links(r)
+    return links
 
 
 class HttpHandler(LocalDirectory):
+    __slots__ = ("remotedirectory", "http")
+
     def __init__(self, url, http=None):
+        session = None
+        if isinstance(http, requests.Session):
+            session, http = http, None
         if http  and not isinstance(http, requests.Response):
-            raise ValueError("expecting a requests response got "%type(http))
+            raise ValueError("expecting a requests response or session got %s"%type(http))
 
         url = urlsplit(url)        
         if url.scheme:
             if url.scheme not in ["http"]:
                 raise ValueError("scheme must be 'http://' for a FtpDirectory")
             if http is None:
-                http = requests.get(url.geturl())
+                session = session or http_session(url.geturl())
+                http = http_page(session, url.geturl())
+                http.session = session
                 #ftp = FTP(url.hostname)
                 
                 ## store the username in the ftp so it can recovered later
@@ -55,12 +263,9 @@ class HttpHandler(LocalDirectory):
             if http is None:
                 raise ValueError("if no explicite sceme is present in url, a valid htp request  must be present")
             directory = url.path                
-            path = os.path.join(http.url, directory)
+            path = urljoin(http.url.rstrip("/")+"/", directory)
 
-        if not hasattr(http, "hrefs"):
-            http.hrefs = {}
-        if not hasattr(http, "srcs"):
-            http.srcs = {}    
+        _session(http)
 
         LocalDirectory.__init__(self, path)
         self.remotedirectory = directory
@@ -87,30 +292,55 @@ class HttpHandler(LocalDirectory):
     
     def makedirs(self, path):
         raise TypeError('http connection is readonly')
+
+    def rename(self, file, other, newfile):
+        raise TypeError('http connection is readonly')
+
+    def remove(self, file):
+        raise TypeError('http connection is readonly')
     
+    def url(self, file=""):
+        """ the url of a file inside the directory """
+        return urljoin(self.http.url.rstrip("/")+"/", 
+                       posixpath.join(self.remotedirectory, file))
+
     def get_hrefs(self):
-        directory  = self.remotedirectory
-        try:
-            hrefs = self.http.hrefs[directory]
-        except KeyError:
-            hrefs = list(http_hrefs(requests.get((self.http.url+'/'+self.remotedirectory))))
-            self.http.hrefs[directory] = hrefs
-        return hrefs
+        return http_listing(self.http, self.url())[0]
 
     def get_srcs(self):
-        directory  = self.remotedirectory
-        try:
-            srcs = self.http.srcs[directory]
-        except KeyError:
-            srcs = list(http_srcs(requests.get((self.http.url+'/'+self.remotedirectory))))
-            self.http.srcs[directory] = srcs
-        return srcs    
+        return http_listing(self.http, self.url())[1]
 
     def ls(self, glb="*"):
+        """ list the links of the directory page from glob, e.g. '*.txt', '*/*.fits'
+
+        The links of a page ending with a '/' are the sub-directories.
+        """
+        return [e.name for e in self.scan(glb)]
+
+    def scan(self, glb="*"):
         glb = http_path2path(self.http, glb)
-        lst = self.get_hrefs()+self.get_srcs()        
-        lst = [f for f in lst if glob.fnmatch.fnmatch(f, glb)]
-        return lst        
+        return list(iterglob(glb, self._listdir))
+
+    def scan_globs(self, globs, exclude=()):
+        """ list of entry matching each glob of the list globs, minus the exclude globs """
+        globs = [http_path2path(self.http, g) for g in globs]
+        return LocalDirectory.scan_globs(self, globs, exclude)
+
+    ## the names are looked up in the links of their directory page
+    _lookup = None
+
+    def iterscan(self, glb="*"):
+        """ iterator of the entry matching glob, the pages are fetched as needed """
+        glb = http_path2path(self.http, glb)
+        return compile_glob(glb).iterglob(self._listdir)
+
+    def _listdir(self, top):
+        """ list of entry of a sub-directory from the links of its page """
+        hrefs, srcs = http_listing(self.http, self.url(posixpath.join(top, "")))
+        return http_entries(hrefs+srcs)
+
+    def iterwalk(self, topdown=True, followlinks=False):
+        return walk_scan(self._listdir, topdown, followlinks)
 
     def isfile(self, filename):
         return True
@@ -121,92 +351,241 @@ class HttpHandler(LocalDirectory):
     def check(self):
         return True 
 
+    def refresh(self, file=''):
+        """ forget the cached page listing file, or the page of the directory """
+        file = http_path2path(self.http, file)
+        http_cache.invalidate(self.url(posixpath.join(posixpath.dirname(file), "")))
+
     def open(self, file, mode='r'):    
         """ open a file inside directory """         
         file = http_path2path(self.http, file)
-        #print ("FTP %s"% os.path.join(self.remotedirectory, file))
-        return HttpFile(self.http, os.path.join(self.remotedirectory, file), mode)  
+        return http_open_reader(self.http, posixpath.join(self.remotedirectory, file), mode)
+
+    def readblocks(self, file, callback, blocksize=BLOCKSIZE):
+        """ download a file by blocks and call callback(block) for each """
+        file = http_path2path(self.http, file)
+        r = _session(self.http).get(self.url(file), stream=True)
+        try:
+            r.raise_for_status()
+            for block in r.iter_content(blocksize):
+                callback(block)
+        finally:
+            r.close()
 
 scheme_lookup['http'] = HttpHandler
 
 
-class HttpFile(StringIO): 
-    def __init__(self, http,  file, mode='r'):
-        if 'w' in mode or 'a' in mode:
-            raise OSError("http file are read only")
-        
-        buf = requests.get(os.path.join(http.url, file)).text
-                
-        StringIO.__init__(self, buf)                          
-        self.file = file
-        self.host = urlsplit(http.url).hostname    
+class HttpFile(io.RawIOBase): 
+    """ Raw binary reader of a http file streamed with iter_content
+
+    The file is requested when open. If the server advertises byte ranges
+    (Accept-Ranges: bytes) the file is seekable : after a seek the next read
+    requests the file from the new position with a Range header, so a part 
+    of a large file can be read without downloading the rest.
+    """
+    def __init__(self, http, file, blocksize=BLOCKSIZE):
+        io.RawIOBase.__init__(self)
         self.http = http
+        self.file = file
+        self.url = urljoin(http.url.rstrip("/")+"/", file)
+        self.host = urlsplit(http.url).hostname
+        self.blocksize = blocksize
+        self.size = None
+        self.ranges = False
+        self._pos = 0     # position of the reader
+        self._stream = 0  # position of the response stream
+        self._response = None
+        self._chunks = None
+        self._buf = b""
+        self._request(0)
+        headers = self._response.headers
+        self.ranges = (headers.get("Accept-Ranges", "").lower() == "bytes" and 
+                       not headers.get("Content-Encoding"))
+        size = headers.get("Content-Length")
+        if size and size.isdigit() and not headers.get("Content-Encoding"):
+            self.size = int(size)
+
     def __repr__(self):
-        return "<open file '%s' in http '%s', mode 'r' at %0x>"%(self.file, self.host, id(self))
-       
+        return "<open file '%s' in http '%s', mode 'rb' at %0x>"%(self.file, self.host, id(self))
 
     @property
     def name(self):
         return self.file
 
     @property
-    def path(self):
-        return fpath(file, http=self.http)
-
-    # def __del__(self):
-    #     self.close()
-                        
-    # def __exit__(self, *args):
-    #     self.close()
-
-    # def __enter__(self):
-    #     return self        
-
-
-
-
-
+    def encoding(self):
+        """ the charset of the file given by the server or None """
+        if self._response is None:
+            return None
+        ctype = self._response.headers.get("Content-Type", "")
+        for param in ctype.split(";")[1:]:
+            k, _, v = param.partition("=")
+            if k.strip().lower() == "charset":
+                return v.strip().strip("'\"") or None
+        return None
+
+    def _request(self, pos):
+        """ (re)start the response stream at pos """
+        self._close_response()
+        headers = {"Range": "bytes=%d-"%pos} if pos else {}
+        r = _session(self.http).get(self.url, headers=headers, stream=True)
+        if r.status_code == 416: # pos after the end of file
+            r.close()
+            self._chunks = iter(())
+        else:
+            try:
+                r.raise_for_status()
+            except:
+                r.close()
+                raise
+            self._response = r
+            self._chunks = r.iter_content(self.blocksize)
+            if pos and r.status_code != 206:
+                ## the range was ignored, skip the begining of the file
+                skip = pos
+                while skip > 0:
+                    chunk = next(self._chunks, b"")
+                    if not chunk:
+                        break
+                    skip -= len(chunk)
+                self._buf = memoryview(chunk)[len(chunk)+skip:] if skip < 0 else b""
+        self._stream = pos
+
+    def _close_response(self):
+        r, self._response = self._response, None
+        self._chunks = None
+        self._buf = b""
+        if r is not None:
+            r.close()
+
+    def readable(self):
+        return True
 
-def http_hrefs(http):
-    soup = BeautifulSoup(http.text, 'html.parser')
+    def seekable(self):
+        return self.ranges
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            if self.size is None:
+                raise io.UnsupportedOperation("size of '%s' is unknown"%self.url)
+            offset += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError("invalid whence (%r)"%whence)
+        if offset != self._pos and not self.ranges:
+            raise io.UnsupportedOperation("'%s' does not accept ranges"%self.url)
+        if offset < 0:
+            raise ValueError("negative seek position %d"%offset)
+        self._pos = offset
+        return offset
+
+    def readinto(self, b):
+        if self._pos != self._stream:
+            if self.size is not None and self._pos >= self.size:
+                return 0
+            self._request(self._pos)
+        if not len(self._buf):
+            chunk = next(self._chunks, b"")
+            if not chunk:
+                return 0
+            self._buf = memoryview(chunk)
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        self._pos += n
+        self._stream += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._close_response()
+            io.RawIOBase.close(self)
+
+
+def http_open_reader(http, file, mode='r', buffering=BLOCKSIZE, encoding=None):
+    """ open a http file for streaming reads
+
+    Return a buffered binary reader or, if 'b' is not in mode, a text reader 
+    decoding the data on the fly with encoding (default, the encoding of the
+    response or utf-8). 
+    """
+    if 'w' in mode or 'a' in mode or '+' in mode:
+        raise OSError("http file are read only")
+    raw = HttpFile(http, file, buffering)
+    f = io.BufferedReader(raw, buffering)
+    if 'b' in mode or not _P3:
+        return f
+    return io.TextIOWrapper(f, encoding or raw.encoding or "utf-8", newline="\n")
+
+
+## the <a> and <img> tags with their attributes. Comments, scripts and styles 
+## are matched to be skipped, unclosed they run to the end of the page as in 
+## a browser. An attribute name cannot hold a '<', so a tag with no '>' (e.g.
+## an unterminated quote) fails at the next tag : the scan stays linear.
+_LINK_TAGS = re.compile(r"""<!--(?:.*?-->|.*)|<(script|style)\b(?:.*?</\1\s*>|.*)|"""
+                        r"""<(a|img)((?:\s+[^\s"'<>/=]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'>]*))?)*)\s*/?>""",
+                        re.I | re.S)
+_LINK_ATTRS = re.compile(r"""([^\s"'<>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]*)))?""")
+
+def http_links(http):
+    """ return the (hrefs, srcs) paths of the links of a page on its host
+
+    The page of the requests response is scanned once for the href of the 
+    <a> tags and the src of the <img> tags. Each path is returned once, links
+    to other hosts are ignored.
+    """
     host = urlsplit(http.url).hostname
-    #return [url + '/' + node.get('href') for node in soup.find_all('a') if urlsplit(node.get('href')).hostname == host]
-    seen = set()
-
-    for node in soup.find_all('a'):
-        href = node.get('href')
-        if href is None:
+    hrefs, srcs = [], []
+    found = {"a": ("href", set(), hrefs), "img": ("src", set(), srcs)}
+    for tag in _LINK_TAGS.finditer(http.text):
+        name = tag.group(2)
+        if name is None:
             continue
-        url = urlsplit(href)
+        key, seen, links = found[name.lower()]
+        link = None
+        for attr in _LINK_ATTRS.finditer(tag.group(3)):
+            if attr.group(1).lower() == key:
+                link = attr.group(2) or attr.group(3) or attr.group(4) or ""
+        if link is None:
+            continue
+        if "&" in link:
+            link = unescape(link)
+        url = urlsplit(link)
         path = url.path
-
         if path in seen:
             continue
-
         seen.add(path)
         if url.hostname == host or not url.hostname:
-            yield url.path 
+            links.append(path)
+    return hrefs, srcs
 
-def http_srcs(http):
-    soup = BeautifulSoup(http.text, 'html.parser')
-    host = urlsplit(http.url).hostname
-    #return [url + '/' + node.get('href') for node in soup.find_all('a') if urlsplit(node.get('href')).hostname == host]
-    seen = set()
+def http_entries(links):
+    """ the entry of the links of a directory page which are its children
 
-    for node in soup.find_all('img'):
-        src = node.get('src')
-        if src is None:
-            continue
-        url = urlsplit(src)
-        path = url.path
-
-        if path in seen:
+    A link ending with '/' is a directory. The links to other places (absolute
+    paths, parent directory, sub-directory items, queries) are ignored. 
+    """
+    seen = set()
+    entries = []
+    for link in links:
+        name = link[:-1] if link.endswith("/") else link
+        if not name or "/" in name or name in (".", "..") or name in seen:
             continue
+        seen.add(name)
+        entries.append(entry(name, 'dir' if link.endswith("/") else 'file'))
+    return entries
 
-        seen.add(path)
-        if url.hostname == host or not url.hostname:
-            yield url.path 
+def http_hrefs(http):
+    """ the paths of the <a> links of a page on its host """
+    return http_links(http)[0]
 
+def http_srcs(http):
+    """ the paths of the <img> sources of a page on its host """
+    return http_links(http)[1]
 
 
 def http_path2path(http,path):
@@ -1,9 +1,16 @@
 from __future__ import print_function
-from .shared import log, scheme_lookup, connection, remove_roots
+from .shared import log, scheme_lookup, connection, entry, walk_scan, iterglob, compile_glob, compile_globs
 import time
 from shutil import rmtree
-import glob
 import os
+import stat
+import errno
+## os.replace overwrite the destination on all platforms (python >= 3.3)
+_replace = getattr(os, "replace", os.rename)
+try:
+    from os import scandir # python >= 3.5
+except ImportError:
+    scandir = None
 
 try:    
     unicode
@@ -14,6 +21,8 @@ except NameError:
 
 class LocalDirectory(object):
     """ Local directory handler """
+    __slots__ = ("directory", "__weakref__")
+
     def __init__(self, directory, _dummy_=None):
         if _dummy_ is not None:
             raise TypeError("Local directory does not support connection got %s"%dummy)
@@ -35,7 +44,7 @@ class LocalDirectory(object):
         """ remove the subrirectory in path """        
         return rmtree(os.path.join(self.directory, path))
                 
-    def get(self, files='*', inside=None, child=None):
+    def get(self, files='*', inside=None, child=None, workers=1, errors=None, resume=False):
         child = (lambda x:x) if child is None else child #self.fpath
 
         files = self.ls(files)
@@ -67,14 +76,144 @@ class LocalDirectory(object):
                     log.notice("file '%s' copied to '%s' "%(file, filepath))                
 
     def ls(self, glb='*'):
-        """ list file in directory from glob. e.g. '*.txt' 
+        """ list file in directory from glob. e.g. '*.txt', '**/*.fits' 
 
         The returned path are relative 
         """
         if isinstance(glb, basestring):                                
-            return remove_roots(glob.glob(os.path.join(self.directory, glb)), self.directory)            
+            return [e.name for e in iterglob(glb, self._listdir, self._lookup)]
         return [s if os.path.exists(os.path.join(self.directory, s)) else None for s in glb]
 
+    def scan_globs(self, globs, exclude=()):
+        """ list of entry matching each glob of the list globs, minus the exclude globs
+
+        All the globs are searched in one walk, each directory is listed once.
+        """
+        groups = [[] for _ in globs]
+        for k, e in compile_globs(globs, exclude).iterglob(self._listdir, self._lookup):
+            groups[k].append(e)
+        return groups
+
+    def iterscan(self, glb='*'):
+        """ iterator of the entry (name, type) matching glob, yielded while the directories are read """
+        return compile_glob(glb).iterglob(self._iterdir, self._lookup)
+
+    def _iterdir(self, top):
+        """ iterator of the entry (name, type) of a sub-directory, read with os.scandir """
+        if scandir is None:
+            for e in self._listdir(top):
+                yield e
+            return
+        try:
+            it = scandir(os.path.join(self.directory, top))
+        except OSError:
+            return
+        try:
+            for e in it:
+                try:
+                    isdir = e.is_dir()
+                except OSError:
+                    isdir = False
+                yield entry(e.name, 'dir' if isdir else 'file')
+        finally:
+            if hasattr(it, "close"):
+                it.close()
+
+    def _listdir(self, top):
+        """ list of entry (name, type) of a sub-directory, [] if it cannot be listed """
+        path = os.path.join(self.directory, top)
+        if scandir is None:
+            try:
+                names = os.listdir(path)
+            except OSError:
+                return []
+            return [entry(n, 'dir' if os.path.isdir(os.path.join(path, n)) else 'file') for n in names]
+        output = []
+        new = tuple.__new__ # faster than entry(...) for large directories
+        try:
+            for e in scandir(path):
+                try:
+                    isdir = e.is_dir()
+                except OSError:
+                    isdir = False
+                output.append(new(entry, (e.name, 'dir' if isdir else 'file', None, None)))
+        except OSError:
+            return []
+        return output
+
+    def _lookup(self, top, name):
+        """ entry (name, type) of one name of a sub-directory or None if it does not exists """
+        path = os.path.join(self.directory, top, name)
+        if not os.path.lexists(path):
+            return None
+        return entry(name, 'dir' if os.path.isdir(path) else 'file')
+
+    def scan(self, glb='*'):
+        """ list file in directory from glob and return a list of entry 
+
+        entry are (name, type, size, mtime) tuples. The directories are read
+        with os.scandir and only the matching files are stat'ed. A broken 
+        symbolic link is a 'link' entry with the size and mtime of the link.
+        """
+        output = []
+        append, new = output.append, tuple.__new__
+        directory, st = self.directory, os.stat
+        for e in self.iterscan(glb):
+            name = e[0]
+            path = os.path.join(directory, name)
+            try:
+                s = st(path)
+            except OSError: # e.g. broken link
+                try:
+                    s = os.lstat(path)
+                except OSError: # removed meanwhile
+                    continue
+                append(new(entry, (name, 'link', s.st_size, s.st_mtime)))
+                continue
+            tpe = 'dir' if stat.S_ISDIR(s.st_mode) else 'file'
+            append(new(entry, (name, tpe, s.st_size, s.st_mtime)))
+        return output
+
+    def iterwalk(self, topdown=True, followlinks=False):
+        """ iterative directory tree walk 
+
+        yield (relative directory, directory names, file names) tuples like
+        os.walk. The top directory is ''. The directory entries are read with 
+        os.scandir so no stat is needed to know the type of a file.
+        """
+        if scandir is None:
+            for w in walk_scan(self._listdir, topdown, followlinks):
+                yield w
+            return
+
+        stack = [("", None)]
+        while stack:
+            top, listed = stack.pop()
+            if listed is not None:
+                yield listed
+                continue
+            dirs, files, links = [], [], set()
+            try:
+                entries = list(scandir(os.path.join(self.directory, top)))
+            except OSError:
+                continue
+            for e in entries:
+                try:
+                    isdir = e.is_dir()
+                except OSError:
+                    isdir = False
+                if isdir:
+                    dirs.append(e.name)
+                    if not followlinks and e.is_symlink():
+                        links.add(e.name)
+                else:
+                    files.append(e.name)
+            if topdown:
+                yield top, dirs, files
+            else:
+                stack.append((top, (top, dirs, files)))
+            stack.extend((os.path.join(top, d), None) for d in reversed(dirs) if d not in links)
+
     def listdir(self):
     	return os.path.listdir(self.directory)    
 
@@ -110,6 +249,35 @@ class LocalDirectory(object):
     def open(self, file, mode='r'):
         """ open a file inside directory """
         return open(os.path.join(self.directory, file), mode) 
+
+    def rename(self, file, other, newfile):
+        """ rename file of this directory to newfile of the directory handler other 
+
+        Return False if the rename is not possible (e.g. other device), the 
+        file has to be copied.
+        """
+        src = os.path.normpath(os.path.join(self.directory, file))
+        dst = os.path.normpath(os.path.join(other.directory, newfile))
+        try:
+            _replace(src, dst)
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                return False
+            raise
+        return True
+
+    def remove(self, file):
+        """ remove a file of the directory """
+        os.remove(os.path.join(self.directory, file))
+
+    def readblocks(self, file, callback, blocksize=64*1024):
+        """ read a file by blocks of blocksize bytes and call callback(block) for each """
+        with open(os.path.join(self.directory, file), 'rb') as f:
+            while True:
+                block = f.read(blocksize)
+                if not block:
+                    break
+                callback(block)
         
     def isfile(self, filename):
         return os.path.isfile(os.path.join(self.directory, filename))
@@ -149,5 +317,9 @@ class LocalDirectory(object):
 
     def check(self):
         return os.path.exists(self.directory) and os.path.isdir(self.directory)            
+
+    def refresh(self, file=''):
+        """ forget what is cached about file, nothing is cached for a local directory """
+        pass
             
 scheme_lookup['file'] = LocalDirectory
\ No newline at end of file
@@ -0,0 +1,146 @@
+#####
+# Columnar table of the metadata of a directory listing
+#
+# dpath.stat_table returns the name, type, size and mtime of the matching
+# files as columns. The columns are numpy arrays when numpy is installed, so a
+# listing of 100k files can be filtered and sorted with vectorized operations,
+# and plain lists otherwise (the masks are then built with filter). The table is filled from one listing per
+# directory (os.scandir locally, MLSD or LIST on ftp), no command is sent per
+# file.
+#
+# This module is imported by the first call to dpath.stat_table.
+######
+from .shared import entry
+from numbers import Integral
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    basestring
+except NameError:
+    basestring = (str, bytes)
+
+## columns of a StatTable, as the fields of an entry
+COLUMNS = ("name", "type", "size", "mtime")
+
+
+class StatTable(object):
+    """ columnar listing : name, type, size and mtime of the files of a directory
+
+    type is 'dir', 'file' or 'link' (a broken link) and isdir is type == 'dir'.
+    size is -1 and mtime nan when the listing does not give them (e.g. the
+    size of a directory on ftp). With numpy the columns are arrays :
+
+        >>> t = d.stat_table("**/*.fits")
+        >>> big = t[(t.size > 2**20) & ~t.isdir]
+        >>> recent = t.sort("mtime", reverse=True)[:10]
+        >>> t.name[t.mtime < time.time()-86400]
+
+    A table is indexed by a column name, a position (return an entry), a slice,
+    a sequence of booleans or a sequence of positions (return a new table).
+    Without numpy the columns are lists, the comparisons above do not make 
+    masks : use filter (or a list of booleans) instead.
+    """
+    __slots__ = COLUMNS
+
+    def __init__(self, name=(), type=(), size=(), mtime=()):
+        if np is not None:
+            self.name = np.asarray(name, dtype=object)
+            self.type = np.asarray(type, dtype=object)
+            self.size = np.asarray(size, dtype=np.int64)
+            self.mtime = np.asarray(mtime, dtype=np.float64)
+        else:
+            self.name, self.type = list(name), list(type)
+            self.size, self.mtime = list(size), list(mtime)
+
+    @classmethod
+    def from_entries(cls, entries):
+        """ build a table from a list of entry (name, type, size, mtime) """
+        nan = float("nan")
+        name, type, size, mtime = [], [], [], []
+        for e in entries:
+            name.append(e[0])
+            type.append(e[1])
+            size.append(-1 if e[2] is None else e[2])
+            mtime.append(nan if e[3] is None else e[3])
+        return cls(name, type, size, mtime)
+
+    @property
+    def isdir(self):
+        """ True for the directories, a boolean array with numpy """
+        if np is not None:
+            return self.type == 'dir'
+        return [t == 'dir' for t in self.type]
+
+    def __len__(self):
+        return len(self.name)
+
+    def __repr__(self):
+        return "<StatTable %d files>"%len(self)
+
+    def __iter__(self):
+        """ iterate over the entry (name, type, size, mtime) of the table """
+        for i in range(len(self)):
+            yield self._entry(i)
+
+    def _entry(self, i):
+        size, mtime = int(self.size[i]), float(self.mtime[i])
+        return entry(self.name[i], self.type[i],
+                     None if size < 0 else size, None if mtime != mtime else mtime)
+
+    def __getitem__(self, item):
+        if isinstance(item, basestring):
+            if item not in COLUMNS and item != "isdir":
+                raise KeyError(item)
+            return getattr(self, item)
+        if isinstance(item, Integral):
+            return self._entry(item)
+        if np is not None:
+            return StatTable(*(getattr(self, c)[item] for c in COLUMNS))
+        if isinstance(item, slice):
+            return StatTable(*(getattr(self, c)[item] for c in COLUMNS))
+        item = list(item)
+        if item and isinstance(item[0], bool):
+            item = [i for i, keep in enumerate(item) if keep]
+        return StatTable(*([getattr(self, c)[i] for i in item] for c in COLUMNS))
+
+    def filter(self, func):
+        """ return a table of the entry for which func(entry) is True
+
+        Slower than a mask on the numpy columns, but works without numpy.
+        """
+        return self[[bool(func(self._entry(i))) for i in range(len(self))]]
+
+    def argsort(self, key="name", reverse=False):
+        """ positions sorting the table by the column key (or a list of columns) """
+        keys = [key] if isinstance(key, basestring) else list(key)
+        if np is not None:
+            ## stable sorts from the last key to the first, the ties keep 
+            ## their order when reversed
+            order = np.arange(len(self))[::-1] if reverse else np.arange(len(self))
+            for k in reversed(keys):
+                order = order[np.argsort(getattr(self, k)[order], kind="stable")]
+            return order[::-1] if reverse else order
+        ## the unknown mtime (nan) are sorted after the others, as numpy does
+        columns = [getattr(self, k) for k in keys]
+        return sorted(range(len(self)), key=lambda i: tuple((c[i] != c[i], c[i]) for c in columns),
+                      reverse=reverse)
+
+    def sort(self, key="name", reverse=False):
+        """ return a new table sorted by the column key (or a list of columns) """
+        return self[self.argsort(key, reverse)]
+
+    def totals(self):
+        """ (number of files, number of directories, total size of the files) """
+        nfiles = nbytes = 0
+        if np is not None:
+            files = ~self.isdir
+            nfiles = int(files.sum())
+            nbytes = int(self.size[files & (self.size > 0)].sum())
+        else:
+            for isdir, size in zip(self.isdir, self.size):
+                if not isdir:
+                    nfiles += 1
+                    nbytes += max(size, 0)
+        return nfiles, len(self)-nfiles, nbytes
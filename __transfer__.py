@@ -0,0 +1,361 @@
+#####
+# Streaming copy of a file between any two paths (local, ftp, http)
+#
+# The source is read by blocks with the readblocks method of its directory
+# handler (a read loop for a local file, retrbinary for ftp, iter_content
+# for http) and written to the destination as it arrives. With several
+# destinations, the blocks are spooled and each destination is written by
+# its own thread.
+######
+from .shared import log
+from collections import OrderedDict
+import threading
+import tempfile
+import shutil
+import errno
+import os
+try:
+    from Queue import Queue, Empty # python 2.7
+except ImportError:
+    from queue import Queue, Empty
+
+## size of the blocks of a copy between two paths
+COPY_BLOCKSIZE = 1024*1024
+## the blocks sent to several destinations are spooled in a temporary file, 
+## in memory up to this size
+SPOOL_SIZE = 4*1024*1024
+## number of destinations written at the same time
+FANOUT_WORKERS = 8
+## bytes asked per call to copy_file_range or sendfile for a local copy
+KERNEL_CHUNK = 1024*1024*1024
+
+## errors meaning that the kernel copy is not possible for these two files
+_KERNEL_ERRORS = set(getattr(errno, n) for n in ("EXDEV", "ENOSYS", "EINVAL", "EBADF",
+                                                  "ENOTSUP", "EOPNOTSUPP", "ENOTSOCK")
+                     if hasattr(errno, n))
+
+
+def _exclusive(src, dst):
+    """ True if the two handlers share one connection that cannot read and write at once
+
+    This is the case of a single ftp connection, a pool of connections
+    can lease one connection for each side.
+    """
+    _, c = src.connection
+    return c is not None and c is dst.connection[1] and not hasattr(c, "lease")
+
+def copy_file(src, dests, blocksize=None, errors=None, workers=None):
+    """ copy the fpath src into all the fpath of dests, return the number of bytes copied
+
+    The source is read only once, by blocks (between two local files the copy
+    is made by the kernel). Each destination is written by its own thread 
+    (and so on its own connection if it is a pool) at its own pace : the blocks are spooled in a temporary file that the destinations 
+    follow, so a slow destination does not stall the others and each one keeps
+    at most one block in memory. The spool is in memory up to SPOOL_SIZE and 
+    on disk after, it is not bounded : it grows up to the size of the source 
+    whatever the lag of the slowest destination. At most workers (default 
+    FANOUT_WORKERS) destinations are written at the same time.
+    A destination is opened with the first block of the source, so a source
+    which cannot be read leaves the destinations untouched. An error of the 
+    source is always raised. If errors is a list, the (dest, exception) of the 
+    failed destinations are appended, otherwise the first error is raised 
+    when all the destinations are done.
+    """
+    blocksize = blocksize or COPY_BLOCKSIZE
+    handler = src.directory.handler
+    reader = spool = None
+    if len(dests) == 1 and not handler.isremote and not dests[0].directory.handler.isremote:
+        ## between two local files, the copy is made by the kernel
+        size = [0]
+        def send(d):
+            size[0] = _send_local(_local_file(src), d, blocksize)
+    elif len(dests) == 1 and not _exclusive(handler, dests[0].directory.handler):
+        ## straight from the source reader to the destination writer
+        size = [0]
+        def send(d):
+            out = _Destination(d)
+            def write(block):
+                out.write(block)
+                size[0] += len(block)
+            try:
+                handler.readblocks(src.filename, write, blocksize)
+            except Exception as e:
+                out.abort()
+                if out.error is not None:
+                    raise
+                raise _SourceError(e)
+            out.close()
+    else:
+        spool = _Spool()
+        def feed():
+            try:
+                handler.readblocks(src.filename, spool.write, blocksize)
+            except BaseException as e:
+                spool.close(e)
+                raise
+            spool.close()
+        if any(_exclusive(handler, d.directory.handler) for d in dests):
+            ## the source connection cannot be used while writing, read it first
+            feed()
+        else:
+            reader = feed
+        send = lambda d: spool.send(d, blocksize)
+    try:
+        _fanout(dests, send, errors, workers, reader)
+    finally:
+        if spool is not None:
+            spool.file.close()
+    log.notice("file '%s' copied to %s"%(src, ", ".join("'%s'"%d for d in dests)))
+    return spool.size if spool is not None else size[0]
+
+
+class _SourceError(Exception):
+    """ an error reading the source of a copy, raised once by copy_file 
+    instead of being reported for each destination
+    """
+    def __init__(self, error):
+        Exception.__init__(self, error)
+        self.error = error
+
+
+class _Destination(object):
+    """ a fpath opened for writing with its first block
+
+    So a source which cannot be read does not truncate an existing file. The
+    error of the destination, if any, is kept in error.
+    """
+    def __init__(self, dest):
+        self.dest = dest
+        self.file = None
+        self.error = None
+
+    def write(self, block):
+        try:
+            if self.file is None:
+                self.file = _open_dest(self.dest)
+            self.file.write(block)
+        except Exception as e:
+            self.error = e
+            raise
+
+    def close(self):
+        """ close the file, an empty source creates an empty file """
+        try:
+            if self.file is None:
+                self.file = _open_dest(self.dest)
+            self.file.close()
+        except Exception as e:
+            self.error = e
+            raise
+
+    def abort(self):
+        """ close the file after an error, ignoring the errors of the close """
+        if self.file is not None:
+            try:
+                self.file.close()
+            except Exception:
+                pass
+
+
+class _Spool(object):
+    """ a temporary file written by one thread and read at the same time by others 
+
+    In memory up to SPOOL_SIZE, on disk after. The spool is not bounded, it 
+    keeps all the source until the copy is done.
+    """
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+        self.size = 0
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def write(self, block):
+        with self._cond:
+            self.file.seek(self.size)
+            self.file.write(block)
+            self.size += len(block)
+            self._cond.notify_all()
+
+    def close(self, error=None):
+        """ mark the end of the file, or the error which stopped the source """
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def read(self, offset, n):
+        """ return at most n bytes from offset, wait until they are written 
+
+        return an empty string at the end of the file
+        """
+        with self._cond:
+            while offset >= self.size and not self.done:
+                self._cond.wait()
+            if self.error is not None:
+                raise _SourceError(self.error)
+            if offset >= self.size:
+                return b""
+            self.file.seek(offset)
+            return self.file.read(min(n, self.size-offset))
+
+    def send(self, dest, blocksize):
+        """ write the spooled file to the fpath dest while it is written """
+        offset = 0
+        out = _Destination(dest)
+        try:
+            while True:
+                block = self.read(offset, blocksize)
+                if not block:
+                    break
+                out.write(block)
+                offset += len(block)
+        except BaseException:
+            out.abort()
+            raise
+        out.close()
+        return offset
+
+
+def _fanout(dests, send, errors=None, workers=None, feed=None):
+    """ call send(dest) for all the dests in parallel threads 
+
+    The destinations sharing a single connection (e.g. a ftp object) are sent 
+    one after the other by the same thread. If feed is given, it is called 
+    in the current thread while the destinations are sent. A _SourceError 
+    raised by send is raised once, after all the destinations.
+    """
+    groups = OrderedDict()
+    for i, d in enumerate(dests):
+        _, c = d.directory.handler.connection
+        key = id(c) if c is not None and not hasattr(c, "lease") else ("dest", i)
+        groups.setdefault(key, []).append((i, d))
+
+    queue = Queue()
+    for group in groups.values():
+        queue.put(group)
+    failed = []
+    source = []
+
+    def work():
+        while True:
+            try:
+                group = queue.get_nowait()
+            except Empty:
+                return
+            for i, d in group:
+                try:
+                    send(d)
+                except _SourceError as e:
+                    source.append(e.error)
+                except Exception as e:
+                    log.error("cannot copy to '%s': %s"%(d, e))
+                    failed.append((i, d, e))
+
+    workers = max(1, min(workers or FANOUT_WORKERS, len(groups)))
+    if workers == 1 and feed is None:
+        work()
+    else:
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        try:
+            if feed is not None:
+                feed()
+        finally:
+            for t in threads:
+                t.join()
+
+    failed.sort(key=lambda f: f[0])
+    if errors is not None:
+        errors.extend((d, e) for _, d, e in failed)
+    if source:
+        raise source[0]
+    if failed and errors is None:
+        raise failed[0][2]
+
+def _open_dest(dest):
+    """ open the fpath dest for writing with the handler of its directory 
+
+    As the source with readblocks, the file is given by its filename : the
+    fpath string can be a full url (e.g. 'ftp://host/data/x').
+    """
+    return dest.directory.handler.open(dest.filename, "wb")
+
+def _local_file(f):
+    return os.path.join(f.directory.handler.directory, f.filename)
+
+def _kernel_copy(fin, fout):
+    """ copy fin into fout inside the kernel, return False if it is not supported """
+    ifd, ofd = fin.fileno(), fout.fileno()
+    for name in ("copy_file_range", "sendfile"):
+        func = getattr(os, name, None)
+        if func is None:
+            continue
+        copied = 0
+        try:
+            while True:
+                if name == "copy_file_range":
+                    n = func(ifd, ofd, KERNEL_CHUNK)
+                else:
+                    n = func(ofd, ifd, copied, KERNEL_CHUNK)
+                if not n:
+                    return True
+                copied += n
+        except OSError as e:
+            if copied or e.errno not in _KERNEL_ERRORS:
+                raise
+    return False
+
+def _send_local(path, dest, blocksize):
+    """ copy the local file path to the local fpath dest, return the number of bytes
+
+    The copy is made by the kernel with copy_file_range or sendfile when 
+    available, the data do not go through python. dest is opened once the 
+    source is.
+    """
+    try:
+        fin = open(path, 'rb')
+    except (IOError, OSError) as e:
+        raise _SourceError(e)
+    with fin:
+        with open(_local_file(dest), 'wb') as fout:
+            if not _kernel_copy(fin, fout):
+                shutil.copyfileobj(fin, fout, blocksize)
+            return fout.tell()
+
+def _same_connection(a, b):
+    """ True if the handlers a and b are of the same kind and on the same connection """
+    return a.__class__ is b.__class__ and a.connection[1] is b.connection[1]
+
+def move_file(src, dst, blocksize=None):
+    """ move the fpath src to the fpath dst and return dst
+
+    The file is renamed when possible : os.replace for local files, RNFR/RNTO 
+    on the same ftp connection. Otherwise (other scheme, other device) it is
+    copied then removed. 
+    """
+    sh, dh = src.directory.handler, dst.directory.handler
+    if _same_connection(sh, dh) and sh.rename(src.filename, dh, dst.filename):
+        return dst
+    copy_file(src, [dst], blocksize)
+    sh.remove(src.filename)
+    return dst
+
+def move_tree(src, dst, blocksize=None):
+    """ move the dpath src to the dpath dst and return dst
+
+    The directory is renamed when possible, otherwise all the tree is copied 
+    then removed.
+    """
+    sh, dh = src.handler, dst.handler
+    if _same_connection(sh, dh) and sh.rename("", dh, ""):
+        return dst
+    for top, dirs, files in sh.iterwalk():
+        d = src.dpath(top) if top else src
+        target = (dst.dpath(top) if top else dst).build()
+        for f in files:
+            copy_file(d.fpath(f), [target.fpath(f)], blocksize)
+    sh.rmtree("")
+    return dst
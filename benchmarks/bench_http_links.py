@@ -0,0 +1,128 @@
+#####
+# Benchmark of the link extraction of http directory pages
+#
+# Compare http_links (one tokenizer pass for the hrefs and the srcs) with a
+# single pass html.parser.HTMLParser and with the former BeautifulSoup code
+# (one parse for the hrefs, one for the srcs) on synthetic autoindex pages.
+# bs4 is optional, its column is skipped if it is not installed.
+#
+#   python benchmarks/bench_http_links.py [nrows ...]
+######
+from __future__ import print_function
+import importlib
+import os
+import sys
+import time
+try:
+    from urlparse import urlsplit # python 2.7
+except ImportError:
+    from urllib.parse import urlsplit
+try:
+    from html.parser import HTMLParser
+except ImportError: # python 2.7
+    from HTMLParser import HTMLParser
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+## the repository is the 'path' package, import it from its parent directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+http_links = importlib.import_module(os.path.basename(ROOT)+".__http__").http_links
+
+ROW = ('<tr><td valign="top"><img src="/icons/%s.gif" alt="[   ]"></td>'
+       '<td><a href="file_%06d.fits">file_%06d.fits</a></td>'
+       '<td align="right">2016-01-01 12:00  </td><td align="right">1.2M</td></tr>')
+ICONS = ("text", "binary", "folder")
+
+
+class Page(object):
+    """ the attributes of a requests response used by the extractors """
+    def __init__(self, url, text):
+        self.url = url
+        self.text = text
+
+def autoindex(nrows):
+    rows = [ROW%(ICONS[i%3], i, i) for i in range(nrows)]
+    return Page("http://server.com/data/",
+                "<html><body><table>\n%s\n</table></body></html>"%"\n".join(rows))
+
+
+def _keep(host, links):
+    """ the paths of links on host, each once, as http_links """
+    seen, paths = set(), []
+    for link in links:
+        url = urlsplit(link)
+        if url.path in seen:
+            continue
+        seen.add(url.path)
+        if url.hostname == host or not url.hostname:
+            paths.append(url.path)
+    return paths
+
+def bs4_links(page):
+    """ the former code : a BeautifulSoup parse for the hrefs and one for the srcs """
+    host = urlsplit(page.url).hostname
+    soup = BeautifulSoup(page.text, 'html.parser')
+    hrefs = [a.get('href') for a in soup.find_all('a') if a.get('href') is not None]
+    soup = BeautifulSoup(page.text, 'html.parser')
+    srcs = [i.get('src') for i in soup.find_all('img') if i.get('src') is not None]
+    return _keep(host, hrefs), _keep(host, srcs)
+
+
+class _LinkParser(HTMLParser):
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.links = {"a": [], "img": []}
+
+    def handle_starttag(self, tag, attrs):
+        key = {"a": "href", "img": "src"}.get(tag)
+        if key is None:
+            return
+        for name, value in attrs:
+            if name == key:
+                self.links[tag].append(value or "")
+                break
+
+def htmlparser_links(page):
+    """ one pass of a html.parser.HTMLParser collecting the hrefs and srcs """
+    host = urlsplit(page.url).hostname
+    parser = _LinkParser()
+    parser.feed(page.text)
+    parser.close()
+    return _keep(host, parser.links["a"]), _keep(host, parser.links["img"])
+
+
+def timeit(func, page, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func(page)
+        best = min(best, time.time()-start) if best is not None else time.time()-start
+    return best, result
+
+def main(sizes):
+    print("%8s %12s %12s %12s"%("rows", "http_links", "HTMLParser", "bs4 (x2)"))
+    for nrows in sizes:
+        page = autoindex(nrows)
+        t, ref = timeit(http_links, page)
+        th, links = timeit(htmlparser_links, page)
+        assert links == tuple(ref), "HTMLParser links differ"
+        tb = "%12s"%"-"
+        if BeautifulSoup is not None:
+            tb, links = timeit(bs4_links, page, 1)
+            assert links == tuple(ref), "bs4 links differ"
+            tb = "%11.3fs"%tb
+        print("%8d %11.3fs %11.3fs %s"%(nrows, t, th, tb))
+
+    ## malformed pages must not make the tokenizer backtrack
+    n = 100000
+    for name, text in [("unclosed comments", "<!--"*n),
+                       ("unterminated quotes", '<a href="x'*n),
+                       ("unclosed tags", "<a title='"+"<a href=x "*n)]:
+        t, _ = timeit(http_links, Page("http://server.com/", text), 1)
+        print("%-20s %11.3fs"%(name, t))
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [1000, 10000])
@@ -3,9 +3,118 @@
 # the valid connection sheme (file, ftp, etc...) 
 ######
 import os
+import re
 import glob
+import fnmatch
+from collections import OrderedDict
+from importlib import import_module
 
-scheme_lookup = {}
+try:    
+    basestring
+except NameError:
+    basestring = (str, bytes)
+
+## entry point group where other packages can declare their own scheme, e.g. :
+##   entry_points={"path.schemes": ["s3 = mypackage.s3path:S3Directory"]}
+ENTRY_POINT_GROUP = "path.schemes"
+
+
+class SchemeRegistry(object):
+    """ mapping of scheme -> directory handler class, loaded on first use
+
+    A scheme is registered with a loader : a 'module:Class' string (the module 
+    can be relative to this package) or a function returning the class. The 
+    module is imported only the first time the scheme is looked up, so using 
+    local paths does not import the ftp or http modules.
+
+        >>> scheme_lookup.register("ftp", ".__ftp__:FtpDirectory")
+        >>> scheme_lookup["ftp"]
+        <class 'path.__ftp__.FtpDirectory'>
+
+    Schemes declared in the 'path.schemes' entry point group of the installed
+    packages are registered the first time an unknown scheme is looked up. 
+    """
+    def __init__(self):
+        self._handlers = {}
+        self._loaders = {}
+        self._entry_points = False
+
+    def register(self, scheme, loader):
+        """ register a loader for scheme, a 'module:Class' string or a function """
+        self._loaders[scheme] = loader
+        self._handlers.pop(scheme, None)
+
+    def __setitem__(self, scheme, handler):
+        self._handlers[scheme] = handler
+
+    def __getitem__(self, scheme):
+        try:
+            return self._handlers[scheme]
+        except KeyError:
+            pass
+        if scheme not in self._loaders:
+            self._load_entry_points()
+        try:
+            loader = self._loaders[scheme]
+        except KeyError:
+            raise KeyError(scheme)
+        if isinstance(loader, basestring):
+            modname, _, attr = loader.partition(":")
+            module = import_module(modname, __name__.rpartition(".")[0])
+            handler = getattr(module, attr)
+        else:
+            handler = loader()
+        self._handlers[scheme] = handler
+        return handler
+
+    def get(self, scheme, default=None):
+        try:
+            return self[scheme]
+        except KeyError:
+            return default
+
+    def __contains__(self, scheme):
+        if scheme in self._handlers or scheme in self._loaders:
+            return True
+        self._load_entry_points()
+        return scheme in self._loaders
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        """ all the registered schemes, loaded or not """
+        return sorted(set(self._handlers).union(self._loaders))
+
+    def values(self):
+        """ the handler classes already loaded """
+        return list(self._handlers.values())
+
+    def _load_entry_points(self):
+        if self._entry_points:
+            return
+        self._entry_points = True
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            try:
+                from pkg_resources import iter_entry_points
+            except ImportError:
+                return
+            eps = iter_entry_points(ENTRY_POINT_GROUP)
+        else:
+            eps = entry_points()
+            eps = eps.select(group=ENTRY_POINT_GROUP) if hasattr(eps, "select") else eps.get(ENTRY_POINT_GROUP, [])
+        for ep in eps:
+            if ep.name in self._loaders or ep.name in self._handlers:
+                continue
+            self._loaders[ep.name] = ep.load
+
+
+scheme_lookup = SchemeRegistry()
+scheme_lookup.register("file", ".__local__:LocalDirectory")
+scheme_lookup.register("ftp", ".__ftp__:FtpDirectory")
+scheme_lookup.register("http", ".__http__:HttpHandler")
 
 
 class connection(tuple):
@@ -27,6 +136,57 @@ class connection(tuple):
         return tuple.__getitem__(self, k)
 
 
+class entry(tuple):
+    """ (name, type, size, mtime) tuple describing one item of a directory listing
+
+        type is 'dir', 'file' or 'link'. size and mtime are None when the
+        connection does not provide them.
+    """
+    __slots__ = ()
+    def __new__(cl, name, type, size=None, mtime=None):
+        return tuple.__new__(cl, (name, type, size, mtime))
+
+    def __repr__(self):
+        return "entry(%r, %r, size=%r, mtime=%r)"%self
+
+    @property
+    def name(self):
+        return self[0]
+
+    @property
+    def type(self):
+        return self[1]
+
+    @property
+    def size(self):
+        return self[2]
+
+    @property
+    def mtime(self):
+        return self[3]
+
+    @property
+    def isdir(self):
+        return self[1] == 'dir'
+
+    @property
+    def isfile(self):
+        return self[1] == 'file'
+
+    @property
+    def islink(self):
+        return self[1] == 'link'
+
+
+class link_entry(entry):
+    """ entry of a symbolic link whose type is the one of its target
+
+        the walks do not enter the links to a directory unless followlinks is True
+    """
+    __slots__ = ()
+    islink = True
+
+
 class _log:
     """ A log class that does nothing unless somebody is declaring 
         an other log class.
@@ -84,6 +244,386 @@ def remove_roots(lst, root):
     return [l[n:] if l[:n]==root else l for l in (os.path.normpath(l) for l in lst)]
 
 
+def match_glob(names, glb):
+    """ filter a list of names with a one level glob pattern 
+
+    As for glob.glob, the names starting with a '.' are matched only if the 
+    pattern starts with a '.' 
+    """
+    if not glob.has_magic(glb):
+        return [n for n in names if n==glb]
+    match = _segment_matcher(glb)
+    return [n for n in names if match(n)]
+
+
+#####
+# Glob engine shared by all the directory handlers
+#
+# A pattern like 'data/**/2016-*/*.fits' is compiled once in a list of 
+# segments : a literal name is followed without listing its directory, a magic
+# segment is a regex matched against the listing of its directory and '**' 
+# matches any number of sub-directories. The handlers only provide a function 
+# listing one directory, each candidate directory is listed once and the 
+# sub-trees which cannot match are never listed.
+######
+
+## maximum number of compiled patterns kept
+GLOB_CACHE_SIZE = 256
+
+## the '**' segment
+RECURSIVE = "**"
+
+def _segment_regex(seg):
+    """ the regex of a one level magic pattern """
+    regex = fnmatch.translate(seg)
+    if not seg.startswith("."):
+        regex = r"(?!\.)"+regex
+    return re.compile(regex)
+
+def _segment_matcher(seg):
+    """ a function matching a name against a one level magic pattern """
+    return _segment_regex(seg).match
+
+
+class Glob(object):
+    """ a glob pattern compiled in per-segment matchers 
+
+        >>> g = compile_glob("**/2016-*/*.fits")
+        >>> [e.name for e in g.iterglob(listdir)]
+
+    where listdir(directory) returns the list of entry of a directory relative 
+    to the top directory of the search ('' for the top directory itself).
+    """
+    __slots__ = ("pattern", "segments", "top", "dironly")
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        ## a pattern ending with '/' only match directories
+        self.dironly = pattern.endswith("/")
+        self.top = "/" if pattern.startswith("/") else ""
+        segments = []
+        for seg in pattern.split("/"):
+            if seg in ("", "."):
+                continue
+            if seg == RECURSIVE:
+                if segments and segments[-1] is RECURSIVE:
+                    continue
+                segments.append(RECURSIVE)
+            elif glob.has_magic(seg):
+                segments.append(_segment_regex(seg))
+            else:
+                segments.append(seg)
+        self.segments = tuple(segments)
+
+    def __repr__(self):
+        return "<Glob %r>"%self.pattern
+
+    def iterglob(self, listdir, lookup=None):
+        """ yield the entry matching the pattern, their name is the path relative to the top
+
+        listdir(directory) must return a list of entry ([] if the directory 
+        cannot be listed). The optional lookup(directory, name) returns the 
+        entry of one name or None, it is used for a literal name when the 
+        directory does not have to be listed.
+        """
+        for _, e in _walk((self,), listdir, lookup):
+            yield e
+
+    def match(self, path):
+        """ True if the relative path match the pattern """
+        parts = [p for p in path.split("/") if p not in ("", ".")]
+        return _match_parts(self.segments, 0, parts, 0)
+
+
+class GlobSet(object):
+    """ several glob patterns searched together, minus the exclude patterns
+
+    All the patterns are matched on the same walk : a directory is listed 
+    once whatever the number of patterns. An exclude pattern without '/' is 
+    matched against the names (e.g. '*.tmp'), otherwise against the paths 
+    relative to the top (e.g. 'old/*'). The excluded directories are not 
+    searched.
+
+        >>> g = compile_globs(["*.fits", "*.log"], exclude=["*.tmp.*"])
+        >>> for i, e in g.iterglob(listdir):
+        ...     print(g.patterns[i], e.name)
+    """
+    __slots__ = ("patterns", "globs", "exclude", "_exclude_name", "_exclude_paths")
+
+    def __init__(self, patterns, exclude=()):
+        self.patterns = tuple(patterns)
+        self.globs = tuple(compile_glob(p) for p in patterns)
+        self.exclude = tuple(exclude)
+        names = [p for p in self.exclude if "/" not in p.strip("/")]
+        self._exclude_name = re.compile("|".join("(?:%s)"%_segment_regex(p.strip("/")).pattern 
+                                                 for p in names)).match if names else None
+        self._exclude_paths = tuple(compile_glob(p) for p in self.exclude if p not in names)
+
+    def __repr__(self):
+        return "<GlobSet %r exclude=%r>"%(self.patterns, self.exclude)
+
+    def excluded(self, path):
+        """ True if the relative path match one of the exclude patterns """
+        if self._exclude_name is not None and self._exclude_name(os.path.basename(path)):
+            return True
+        return any(g.match(path) for g in self._exclude_paths)
+
+    def iterglob(self, listdir, lookup=None):
+        """ yield (index of the pattern, entry) of the items matching the patterns
+
+        see Glob.iterglob. An item matching several patterns is yielded once
+        for each.
+        """
+        if not self.exclude:
+            for item in _walk(self.globs, listdir, lookup):
+                yield item
+            return
+        excluded = self.excluded
+        for k, e in _walk(self.globs, listdir, lookup, excluded):
+            if not excluded(e[0]):
+                yield k, e
+
+
+def _match_parts(segments, i, parts, j):
+    """ True if parts[j:] match segments[i:] """
+    while i < len(segments):
+        seg = segments[i]
+        if seg is RECURSIVE:
+            for k in range(j, len(parts)+1):
+                if _match_parts(segments, i+1, parts, k):
+                    return True
+                if k < len(parts) and parts[k][:1] == ".":
+                    break
+            return False
+        if j >= len(parts):
+            return False
+        if isinstance(seg, basestring):
+            if seg != parts[j]:
+                return False
+        elif not seg.match(parts[j]):
+            return False
+        i += 1
+        j += 1
+    return j == len(parts)
+
+
+_alternations = {}
+
+def _alternation(regexes):
+    """ one regex matching any of several regex, None if they cannot be combined 
+
+    Return (match function, {group index: position of the regex}), the group 
+    index of the first regex matching a name is the lastindex of the match.
+    """
+    try:
+        return _alternations[regexes]
+    except KeyError:
+        pass
+    if len(_alternations) >= GLOB_CACHE_SIZE:
+        _alternations.clear()
+    try:
+        compiled = re.compile("|".join("(%s)"%r for r in regexes))
+    except re.error: # e.g. the same group name used by two patterns
+        alternation = None
+    else:
+        positions, group = {}, 1
+        for n, r in enumerate(regexes):
+            positions[group] = n
+            group += 1+re.compile(r).groups
+        alternation = (compiled.match, positions)
+    _alternations[regexes] = alternation
+    return alternation
+
+def _closure(globs, states):
+    """ add to states the segments following a '**' matching no directory """
+    closed = set(states)
+    for k, i in states:
+        segments = globs[k].segments
+        if segments[i] is RECURSIVE and i < len(segments)-1:
+            closed.add((k, i+1))
+    return tuple(sorted(closed))
+
+def _magic_matcher(globs, states):
+    """ a function returning the (k, i) states of a name matching the magic segment i of glob k 
+
+    The names are first matched against the alternation of all the segments,
+    so a name matching none of them costs one regex call.
+    """
+    regexes = [globs[k].segments[i] for k, i in states]
+    if len(regexes) == 1:
+        match, matched = regexes[0].match, (states[0],)
+        return lambda name: matched if match(name) else ()
+    alternation = _alternation(tuple(r.pattern for r in regexes))
+    if alternation is None:
+        return lambda name: [s for s, r in zip(states, regexes) if r.match(name)]
+    match, positions = alternation
+    def matcher(name):
+        m = match(name)
+        if m is None:
+            return ()
+        ## the regex before the first matching one do not match
+        first = positions[m.lastindex]
+        return [states[first]]+[s for s, r in zip(states[first+1:], regexes[first+1:]) if r.match(name)]
+    return matcher
+
+def _walk(globs, listdir, lookup=None, excluded=None):
+    """ yield (k, entry) of the items matching the glob k, see Glob.iterglob 
+
+    The tree is walked once for all the globs : a directory is visited with 
+    the set of (glob, segment) states which can still match inside it and its
+    listing is read once, in one pass, so listdir can return an iterator 
+    streaming the entries.
+    """
+    tops = OrderedDict()
+    for k, g in enumerate(globs):
+        if g.segments:
+            tops.setdefault(g.top, []).append((k, 0))
+    stack = [(top, _closure(globs, states)) for top, states in reversed(list(tops.items()))]
+    while stack:
+        top, states = stack.pop()
+        prefix = os.path.join(top, "") if top else ""
+        ## the entries are yielded as listed in the top directory, renamed below
+        found = (lambda e: e) if not prefix else (lambda e: entry(prefix+e[0], *e[1:]))
+        children = OrderedDict() # name -> states
+        recursive, magic, literals = [], [], OrderedDict()
+        for k, i in states:
+            g = globs[k]
+            seg, last = g.segments[i], len(g.segments)-1
+            if seg is RECURSIVE:
+                recursive.append((k, i))
+            elif not isinstance(seg, basestring):
+                magic.append((k, i))
+            elif i < last and not (i+1 == last and g.segments[last] is RECURSIVE):
+                ## a literal directory is followed without listing
+                children.setdefault(seg, set()).add((k, i+1))
+            else:
+                literals.setdefault(seg, []).append((k, i))
+
+        if recursive or magic:
+            entries = listdir(top)
+        elif len(literals) == 1 and lookup is not None:
+            name = next(iter(literals))
+            e = lookup(top, name)
+            entries = [] if e is None else [e]
+        elif literals:
+            entries = listdir(top)
+        else:
+            entries = []
+        match = _magic_matcher(globs, magic) if magic else None
+
+        if len(magic) == 1 and not recursive and not literals and not children:
+            k, i = magic[0]
+            g = globs[k]
+            if i == len(g.segments)-1 and not g.dironly:
+                ## the most common case : a pattern on the names of one directory
+                regex = g.segments[i].match
+                for e in entries:
+                    if regex(e[0]):
+                        yield k, found(e)
+                continue
+
+        for e in entries:
+            name = e[0]
+            isdir = e[1] == 'dir'
+            if recursive and name[:1] != ".":
+                for k, i in recursive:
+                    g = globs[k]
+                    if i == len(g.segments)-1 and (isdir or not g.dironly):
+                        yield k, found(e)
+                    if isdir:
+                        children.setdefault(name, set()).add((k, i))
+            for k, i in literals.get(name, ()):
+                g = globs[k]
+                if i < len(g.segments)-1: # 'a/**' match 'a' itself
+                    if isdir:
+                        yield k, found(e)
+                        children.setdefault(name, set()).add((k, i+1))
+                elif isdir or not g.dironly:
+                    yield k, found(e)
+            if match is None:
+                continue
+            for k, i in match(name):
+                g = globs[k]
+                last = len(g.segments)-1
+                if i == last:
+                    if isdir or not g.dironly:
+                        yield k, found(e)
+                elif isdir:
+                    children.setdefault(name, set()).add((k, i+1))
+                    if i+1 == last and g.segments[last] is RECURSIVE:
+                        yield k, found(e)
+
+        for name in reversed(list(children)):
+            path = prefix+name
+            if excluded is None or not excluded(path):
+                stack.append((path, _closure(globs, children[name])))
+
+
+_globs = {}
+
+def compile_glob(pattern):
+    """ the compiled Glob of a pattern, compiled patterns are cached """
+    try:
+        return _globs[pattern]
+    except KeyError:
+        pass
+    if len(_globs) >= GLOB_CACHE_SIZE:
+        _globs.clear()
+    g = _globs[pattern] = Glob(pattern)
+    return g
+
+def compile_globs(patterns, exclude=()):
+    """ the compiled GlobSet of several patterns and exclude patterns, cached """
+    key = (tuple(patterns), tuple(exclude))
+    try:
+        return _globs[key]
+    except KeyError:
+        pass
+    if len(_globs) >= GLOB_CACHE_SIZE:
+        _globs.clear()
+    g = _globs[key] = GlobSet(*key)
+    return g
+
+def iterglob(pattern, listdir, lookup=None):
+    """ yield the entry matching a glob pattern (see Glob.iterglob) """
+    return compile_glob(pattern).iterglob(listdir, lookup)
+
+
+
+def walk_scan(listdir, topdown=True, followlinks=False):
+    """ iterative directory tree walk from a listdir(top) function returning entries
+
+    yield (relative directory, directory names, file names) tuples like os.walk,
+    the top directory is ''. In topdown mode, the directory names can be 
+    modified in place to prune the walk. The names are taken as listed (no 
+    glob), the links to a directory are yielded in the directory names but 
+    entered only if followlinks is True.
+    """
+    stack = [("", None)]
+    while stack:
+        top, listed = stack.pop()
+        if listed is not None:
+            yield listed
+            continue
+        try:
+            entries = listdir(top)
+        except os.error:
+            continue
+        dirs, files, links = [], [], set()
+        for e in entries:
+            if e.isdir:
+                dirs.append(e.name)
+                if not followlinks and e.islink:
+                    links.add(e.name)
+            else:
+                files.append(e.name)
+        if topdown:
+            yield top, dirs, files
+        else:
+            stack.append((top, (top, dirs, files)))
+        stack.extend((os.path.join(top, d), None) for d in reversed(dirs) if d not in links)
+
+
 # def real_join(a, *p):
 #     """ Same as os.path.join except that the '..' and '.' are handled and removed 
 
@@ -0,0 +1,16 @@
+#####
+# The repository is the 'path' package itself : load it under that name so
+# the tests can 'from path import dpath' without installing it.
+######
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "path" not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+        "path", os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["path"] = module
+    spec.loader.exec_module(module)
@@ -0,0 +1,28 @@
+import os
+from path import dpath
+
+
+def _tree(tmpdir):
+    os.makedirs(os.path.join(tmpdir, "data", "sub"))
+    open(os.path.join(tmpdir, "data", "sub", "x.txt"), "w").close()
+
+
+def test_nested_relative_path_handler(tmpdir, monkeypatch):
+    ## the handler of d.path must not join the parent a second time
+    _tree(str(tmpdir))
+    monkeypatch.chdir(str(tmpdir))
+    d = dpath("data").dpath("sub")
+    assert d.path == os.path.join("data", "sub")
+    assert d.path.handler.directory == os.path.join("data", "sub")
+    assert d.path.ls() == ["x.txt"]
+    assert d.fullpath.ls() == ["x.txt"]
+    assert dpath("data").dpaths(["sub"])[0].path.ls() == ["x.txt"]
+
+
+def test_iterwalk_relative_tops(tmpdir, monkeypatch):
+    _tree(str(tmpdir))
+    monkeypatch.chdir(str(tmpdir))
+    walked = dict((top.path, files) for top, dirs, files in dpath("data").iterwalk())
+    assert walked == {"data": [], os.path.join("data", "sub"): ["x.txt"]}
+    for top in walked:
+        assert top.ls() == walked[top] + (["sub"] if top == "data" else [])
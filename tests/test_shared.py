@@ -0,0 +1,21 @@
+import os
+from path import dpath
+
+
+def _touch(root, *names):
+    for name in names:
+        path = os.path.join(root, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, "w").close()
+
+
+def test_globs_top_and_literal_prefix(tmpdir):
+    ## a pattern of the top directory must not stop the walk of 'a/'
+    root = str(tmpdir)
+    _touch(root, "x.txt", "y.dat", os.path.join("a", "b.txt"), os.path.join("a", "c.dat"))
+    d = dpath(root)
+    found = d.ls(["*.txt", "a/*"])
+    assert sorted(found["*.txt"]) == ["x.txt"]
+    assert sorted(found["a/*"]) == [os.path.join("a", "b.txt"), os.path.join("a", "c.dat")]
+    assert sorted(d.ls("a/*")) == sorted(found["a/*"])
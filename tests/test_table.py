@@ -0,0 +1,14 @@
+import os
+from path import dpath
+
+
+def test_stat_table_types(tmpdir):
+    ## a broken link stays a 'link' entry, not a file
+    root = str(tmpdir)
+    os.makedirs(os.path.join(root, "sub"))
+    open(os.path.join(root, "a.txt"), "w").close()
+    os.symlink(os.path.join(root, "nope"), os.path.join(root, "broken"))
+    t = dpath(root).stat_table("*").sort("name")
+    assert [e.type for e in t] == ["file", "link", "dir"]
+    assert [bool(isdir) for isdir in t.isdir] == [False, False, True]
+    assert [e.name for e in t.filter(lambda e: not e.isdir)] == ["a.txt", "broken"]